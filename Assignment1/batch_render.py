@@ -0,0 +1,69 @@
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ques2 import render_orbit
+
+
+def render_volume(input, output_dir, use_phong_shading, frames, size, elevation, data_driven, crop_threshold):
+    # Worker task: the whole VTK pipeline of one volume lives in one process
+    name = os.path.splitext(os.path.basename(input))[0]
+    return render_orbit(input, os.path.join(output_dir, name), use_phong_shading, frames, size, elevation,
+                        data_driven, crop_threshold)
+
+
+def render_volumes(inputs, output_dir, use_phong_shading=False, frames=36, size=(1000, 1000), elevation=0.0,
+                   data_driven=True, crop_threshold=0.01, workers=None):
+    """
+    Render a camera orbit of every volume offscreen, one volume per task
+    across a process pool. Returns {input: per-frame timings}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    count = len(inputs)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        timings = pool.map(render_volume, inputs, [output_dir] * count, [use_phong_shading] * count,
+                           [frames] * count, [tuple(size)] * count, [elevation] * count,
+                           [data_driven] * count, [crop_threshold] * count)
+        return dict(zip(inputs, timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render volume camera orbits to PNG without a display.")
+    parser.add_argument('inputs', nargs='+', help=".vti files or glob patterns")
+    parser.add_argument('--output-dir', default='renders')
+    parser.add_argument('--frames', type=int, default=36, help="camera positions per orbit (2 = front and back)")
+    parser.add_argument('--size', type=int, nargs=2, default=(1000, 1000), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--elevation', type=float, default=0.0, help="camera elevation of the orbit in degrees")
+    parser.add_argument('--phong', action='store_true', help="use Phong shading")
+    parser.add_argument('--isabel-transfer', action='store_true',
+                        help="use the fixed Isabel pressure transfer functions instead of the data quantiles")
+    parser.add_argument('--crop-threshold', type=float, default=0.01,
+                        help="render only the box of bricks more opaque than this (default 0.01)")
+    parser.add_argument('--no-crop', action='store_true', help="render the whole volume")
+    parser.add_argument('--workers', type=int, help="processes (default: one per CPU)")
+    parser.add_argument('--timings', help="write the per-frame timings to this JSON file")
+    args = parser.parse_args()
+
+    inputs = sorted({path for pattern in args.inputs for path in glob.glob(pattern)})
+    results = render_volumes(inputs, args.output_dir, args.phong, args.frames, args.size, args.elevation,
+                             not args.isabel_transfer, None if args.no_crop else args.crop_threshold, args.workers)
+
+    # The first frame also uploads the volume to the GPU, so it is reported apart
+    for input, frames in results.items():
+        render_times = np.array([frame['render_s'] for frame in frames]) * 1000
+        write_times = np.array([frame['write_s'] for frame in frames]) * 1000
+        print("%s: first frame %.1f ms, then render p50 %.1f ms / max %.1f ms, PNG write p50 %.1f ms" % (
+            input, render_times[0], np.median(render_times[1:] if len(frames) > 1 else render_times),
+            render_times.max(), np.median(write_times)))
+
+    if args.timings:
+        with open(args.timings, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
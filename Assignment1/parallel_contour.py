@@ -0,0 +1,99 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ques1 import get_scalar_grid, classify_cells, interpolate_edges, build_contour_polydata
+
+# Scalar grid attached by each worker process
+worker_values = None
+worker_memory = None
+
+
+def attach_shared_grid(name, shape, dtype):
+    # Pool initializer: map the shared scalar buffer once per worker
+    global worker_values, worker_memory
+    worker_memory = shared_memory.SharedMemory(name=name)
+    worker_values = np.ndarray(shape, dtype=dtype, buffer=worker_memory.buf)
+
+
+def contour_tile(isovalue, tile):
+    """
+    Contour the cells of one tile of the shared grid.
+    The tile covers cells [i0, i1) x [j0, j1), so its points overlap the
+    neighbouring tiles by one row / column of the seam.
+    """
+    i0, i1, j0, j1 = tile
+    ny, nx = worker_values.shape
+    # Classify the tile as a grid of its own (a view), then move its ids to the whole grid
+    tile_values = worker_values[j0:j1 + 1, i0:i1 + 1]
+    tile_cells, tile_edges = classify_cells(tile_values, isovalue)
+    crossed_edges, segments = np.unique(tile_edges, return_inverse=True)
+
+    segment_cells = (j0 + tile_cells // (i1 - i0)) * (nx - 1) + i0 + tile_cells % (i1 - i0)
+    # Local and global edge ids keep the same order, so the unique edges stay sorted
+    tile_nx = i1 - i0 + 1
+    horizontal_edges = (j1 - j0 + 1) * (tile_nx - 1)
+    vertical = crossed_edges >= horizontal_edges
+    local = np.where(vertical, crossed_edges - horizontal_edges, crossed_edges)
+    row_length = np.where(vertical, tile_nx, tile_nx - 1)
+    crossed_edges = np.where(vertical, ny * (nx - 1) + (j0 + local // row_length) * nx,
+                             (j0 + local // row_length) * (nx - 1)) + i0 + local % row_length
+
+    points = interpolate_edges(worker_values, isovalue, crossed_edges)
+    return segment_cells, crossed_edges, points, segments.reshape(-1, 2)
+
+
+def split_tiles(shape, tile_size):
+    # Split the cell grid into tiles of at most tile_size = (cells in x, cells in y)
+    ny, nx = shape
+    tiles = []
+    for j0 in range(0, ny - 1, tile_size[1]):
+        for i0 in range(0, nx - 1, tile_size[0]):
+            tiles.append((i0, min(i0 + tile_size[0], nx - 1), j0, min(j0 + tile_size[1], ny - 1)))
+    return tiles
+
+
+def merge_tiles(results):
+    # Stitch the per-tile outputs, keeping one point per crossed seam edge
+    segment_cells = np.concatenate([r[0] for r in results])
+    tile_edges = np.concatenate([r[1] for r in results])
+    tile_points = np.concatenate([r[2] for r in results])
+    offsets = np.cumsum([0] + [len(r[1]) for r in results[:-1]])
+    segment_edges = tile_edges[np.concatenate([r[3] + offset for r, offset in zip(results, offsets)])]
+
+    crossed_edges, first = np.unique(tile_edges, return_index=True)
+    points = tile_points[first]
+    segments = np.searchsorted(crossed_edges, segment_edges)
+
+    # Same segment order as the serial engine
+    order = np.argsort(segment_cells, kind='stable')
+    return points, segments[order].reshape(-1, 2)
+
+
+def generate_smooth_isocontour_parallel(image_data, isovalue, tile_size=(512, 512), workers=None,
+                                        smoothing=None, iterations=2, tolerance=0.0):
+    """
+    Tiled, multi-process version of generate_smooth_isocontour.
+    The scalar grid is placed in shared memory once and the tiles are contoured
+    across a process pool; the output matches the serial one exactly.
+    """
+    values = get_scalar_grid(image_data)
+    tiles = split_tiles(values.shape, tile_size)
+    workers = workers or os.cpu_count()
+
+    memory = shared_memory.SharedMemory(create=True, size=values.nbytes)
+    try:
+        shared_values = np.ndarray(values.shape, dtype=values.dtype, buffer=memory.buf)
+        shared_values[:] = values
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach_shared_grid,
+                                 initargs=(memory.name, values.shape, values.dtype)) as pool:
+            results = list(pool.map(contour_tile, [isovalue] * len(tiles), tiles))
+        del shared_values
+    finally:
+        memory.close()
+        memory.unlink()
+
+    points, segments = merge_tiles(results)
+    return build_contour_polydata(image_data, points, segments, smoothing, iterations, tolerance)
@@ -1,100 +1,282 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 import vtk
+import numpy as np
+from vtk.util import numpy_support
+
+from common import instrument
+from common.sequence import run_sequence, read_vti_image, is_sequence
+from common.vti_io import load_vti
+from common.vtp_io import polydata_from_arrays, polyline_polydata, write_vtp
 
 def load_dataset(input_file):
-    # Step 1: Load the dataset in VTKImageData format
-    reader = vtk.vtkXMLImageDataReader()
-    reader.SetFileName(input_file)
-    reader.Update()
-    
-    return reader.GetOutput()
+    # Step 1: Load the dataset in VTKImageData format (memory-mapped, no copy)
+    return load_vti(input_file)
 
 
 
-def generate_smooth_isocontour(image_data, isovalue):
+def get_scalar_grid(image_data):
+    # Pull the point scalars once as a (ny, nx) NumPy view (x varies fastest)
     dimensions = image_data.GetDimensions()
+    scalars = numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())
+    return scalars.reshape(dimensions[1], dimensions[0])
+
+
+def classify_cells(values, isovalue, cell_ids=None):
+    """
+    Classify the cells of a (ny, nx) scalar grid in one vectorized pass.
+    Returns the cell id of every line segment and the global ids of the two
+    crossed edges it connects, ordered by cell id.
+    """
+    ny, nx = values.shape
+    if cell_ids is None:
+        # Find the crossed cells with slice views and one byte per point / edge,
+        # then do the per-cell work below only for those
+        sign = (values > isovalue).astype(np.int8) - (values < isovalue)
+        horizontal = sign[:, :-1] * sign[:, 1:] < 0
+        vertical = sign[:-1, :] * sign[1:, :] < 0
+        del sign
+        crossed = horizontal[:-1].astype(np.uint8) + vertical[:, 1:] + horizontal[1:] + vertical[:, :-1]
+        cell_ids = np.flatnonzero(crossed)
+        del horizontal, vertical, crossed
+    i = cell_ids % (nx - 1)
+    j = cell_ids // (nx - 1)
+
+    corners = np.stack([values[j, i], values[j, i + 1],
+                        values[j + 1, i + 1], values[j + 1, i]], axis=1) - isovalue
+    crossings = corners * np.roll(corners, -1, axis=1) < 0
+    crossing_count = crossings.sum(axis=1)
+
+    # Global edge ids: horizontal edges first, then vertical edges
+    horizontal_edges = ny * (nx - 1)
+    edge_ids = np.stack([j * (nx - 1) + i,
+                         horizontal_edges + j * nx + i + 1,
+                         (j + 1) * (nx - 1) + i,
+                         horizontal_edges + j * nx + i], axis=1)
+
+    # Regular cells: connect the two crossed edges
+    regular = np.flatnonzero(crossing_count == 2)
+    regular_edges = np.nonzero(crossings[regular])[1].reshape(-1, 2)
+    segment_cells = [cell_ids[regular]]
+    segment_edges = [np.take_along_axis(edge_ids[regular], regular_edges, axis=1)]
+
+    # Saddle cells: resolve with the value at the cell center
+    saddle = np.flatnonzero(crossing_count == 4)
+    if len(saddle):
+        center = corners[saddle].mean(axis=1)
+        joined = center * corners[saddle, 0] > 0
+        saddle_edges = np.where(joined[:, None, None],
+                                np.array([[0, 1], [2, 3]]), np.array([[3, 0], [1, 2]]))
+        saddle_ids = edge_ids[saddle][np.arange(len(saddle))[:, None, None], saddle_edges]
+        segment_cells.append(np.repeat(cell_ids[saddle], 2))
+        segment_edges.append(saddle_ids.reshape(-1, 2))
+
+    segment_cells = np.concatenate(segment_cells)
+    segment_edges = np.concatenate(segment_edges)
+    order = np.argsort(segment_cells, kind='stable')
+    return segment_cells[order], segment_edges[order]
+
+
+def interpolate_edges(values, isovalue, edges):
+    # Linear interpolation of the isovalue crossing on each global edge id
+    ny, nx = values.shape
+    horizontal_edges = ny * (nx - 1)
+    vertical = edges >= horizontal_edges
+    local = np.where(vertical, edges - horizontal_edges, edges)
+    row_length = np.where(vertical, nx, nx - 1)
+    start_i = local % row_length
+    start_j = local // row_length
+    end_i = start_i + ~vertical
+    end_j = start_j + vertical
+    start_value = values[start_j, start_i]
+    t = (isovalue - start_value) / (values[end_j, end_i] - start_value)
+    return np.stack([start_i + t * (end_i - start_i), start_j + t * (end_j - start_j)], axis=1)
+
+
+def marching_squares(values, isovalue, cell_ids=None):
+    """
+    Vectorized marching squares over a (ny, nx) scalar grid.
+    Returns the crossing points in grid index coordinates (one per crossed edge)
+    and the line segments as pairs of point indices.
+    """
+    _, segment_edges = classify_cells(values, isovalue, cell_ids)
+
+    # Interpolate each crossed edge only once
+    crossed_edges, segments = np.unique(segment_edges, return_inverse=True)
+    points = interpolate_edges(values, isovalue, crossed_edges)
+    return points, segments.reshape(-1, 2)
+
+
+def stitch_segments(segments, point_count):
+    """
+    Join line segments that share end points into ordered polylines.
+    Points are keyed by their crossed edge, and an edge is shared by at most
+    the two cells on either side of it, so every point has at most two
+    neighbours: open polylines end on the grid border and closed ones repeat
+    their first point at the end. Returns one point index list per polyline.
+    """
+    # Neighbour table indexed by point (edge) id, -1 where there is none
+    ends = segments.ravel()
+    partners = segments[:, ::-1].ravel()
+    order = np.argsort(ends, kind='stable')
+    ends, partners = ends[order], partners[order]
+    second = np.r_[False, ends[1:] == ends[:-1]]
+    neighbors = np.full((point_count, 2), -1)
+    neighbors[ends, second.astype(int)] = partners
+    degree = (neighbors >= 0).sum(axis=1)
+
+    neighbor_list = neighbors.tolist()
+    visited = [False] * point_count
+    polylines = []
+    # Open polylines start at a point with one neighbour, the rest are loops
+    starts = np.concatenate([np.flatnonzero(degree == 1), np.flatnonzero(degree == 2)]).tolist()
+    for start in starts:
+        if visited[start]:
+            continue
+        visited[start] = True
+        polyline = [start]
+        previous, current = -1, start
+        while True:
+            first, second = neighbor_list[current]
+            step = second if first == previous else first
+            if step == start:
+                polyline.append(start)
+                break
+            if step == -1 or visited[step]:
+                break
+            visited[step] = True
+            polyline.append(step)
+            previous, current = current, step
+        polylines.append(polyline)
+    return polylines
+
 
-    contour_polydata = vtk.vtkPolyData()
-    points = vtk.vtkPoints()
-    lines = vtk.vtkCellArray()
-
-    isocontour_segment = []
-
-    def add_isocontour_segment(segment):
-        line_id = lines.InsertNextCell(len(segment))
-        for point_id in segment:
-            lines.InsertCellPoint(point_id)
-
-    def interpolate(p1, p2, t):
-        return [p1[i] + t * (p2[i] - p1[i]) for i in range(2)]
-
-    def smooth_isocontour_segment(segment):
-        smoothed_segment = []
-        for i in range(len(segment) - 1):
-            p1 = image_data.GetPoint(segment[i])
-            p2 = image_data.GetPoint(segment[i + 1])
-            smoothed_segment.append(segment[i])
-            #isocontour_point = p2
-            #point_id = points.InsertNextPoint(isocontour_point[0], isocontour_point[1], 0)
-            #smoothed_segment.append(point_id)
-
-            #for t in [1]:  # Adjust the weights for smoother result
-                #isocontour_point = interpolate(p1, p2, t)
-                #point_id = points.InsertNextPoint(isocontour_point[0], isocontour_point[1], 0)
-                #smoothed_segment.append(point_id)
-                #isocontour_point = interpolate(p1, p2, t)
-                #smoothed_segment.append(points.InsertNextPoint(isocontour_point[0], isocontour_point[1], 0))
-
-            #smoothed_segment.append(segment[i + 1])
-        return smoothed_segment
-
-    for i in range(dimensions[0] - 1):
-        for j in range(dimensions[1] - 1):
-            v1 = image_data.GetPointData().GetScalars().GetValue(j * dimensions[0] + i)
-            v2 = image_data.GetPointData().GetScalars().GetValue(j * dimensions[0] + (i + 1))
-            v3 = image_data.GetPointData().GetScalars().GetValue((j + 1) * dimensions[0] + (i + 1))
-            v4 = image_data.GetPointData().GetScalars().GetValue((j + 1) * dimensions[0] + i)
-
-            crossings = ((v1 - isovalue) * (v2 - isovalue) < 0, (v2 - isovalue) * (v3 - isovalue) < 0,
-                          (v3 - isovalue) * (v4 - isovalue) < 0, (v4 - isovalue) * (v1 - isovalue) < 0)
-
-            for edge, (p1, p2) in enumerate([(0, 1), (1, 2), (2, 3), (3, 0)]):
-                if crossings[edge]:
-                    t = (isovalue - [v1, v2, v3, v4][p1]) / ([v1, v2, v3, v4][p2] - [v1, v2, v3, v4][p1])
-                    point_id_1 = j * dimensions[0] + i
-                    point_id_2 = j * dimensions[0] + (i + 1)
-                    point_id_3 = (j + 1) * dimensions[0] + (i + 1)
-                    point_id_4 = (j + 1) * dimensions[0] + i
-                    x, y, _ = image_data.GetPoint(point_id_1) if edge in [0, 2] else image_data.GetPoint(point_id_4)
-                    next_x, next_y, _ = image_data.GetPoint(point_id_2) if edge in [0, 2] else image_data.GetPoint(point_id_3)
-
-                    isocontour_point = [x + t * (next_x - x), y + t * (next_y - y)]
-                    point_id = points.InsertNextPoint(isocontour_point[0], isocontour_point[1], 0)
-                    isocontour_segment.append(point_id)
-
-            
-            if len(isocontour_segment) == 2:
-                # Smooth the isocontour segment
-                smoothed_segment = smooth_isocontour_segment(isocontour_segment)
-                add_isocontour_segment(smoothed_segment)
-
-            isocontour_segment = []
-
-    contour_polydata.SetPoints(points)
-    contour_polydata.SetLines(lines)
-
-    clean_filter = vtk.vtkCleanPolyData()
-    clean_filter.SetInputData(contour_polydata)
-    clean_filter.Update()
-
-    return clean_filter.GetOutput()
+def chaikin_smooth(curve, closed, iterations=2):
+    # Corner cutting: every edge is replaced by its 1/4 and 3/4 points (open ends stay fixed)
+    for _ in range(iterations):
+        if closed:
+            start, end = curve[:-1], np.roll(curve[:-1], -1, axis=0)
+        else:
+            start, end = curve[:-1], curve[1:]
+        cut = np.empty((2 * len(start), curve.shape[1]))
+        cut[0::2] = 0.75 * start + 0.25 * end
+        cut[1::2] = 0.25 * start + 0.75 * end
+        curve = np.vstack([cut, cut[:1]]) if closed else np.vstack([curve[:1], cut, curve[-1:]])
+    return curve
+
+
+def laplacian_smooth(curve, closed, iterations=2, weight=0.5):
+    # Move every point towards the midpoint of its neighbours (open ends stay fixed)
+    curve = curve.copy()
+    for _ in range(iterations):
+        if closed:
+            ring = curve[:-1]
+            ring += weight * ((np.roll(ring, 1, axis=0) + np.roll(ring, -1, axis=0)) / 2 - ring)
+            curve[-1] = ring[0]
+        else:
+            curve[1:-1] += weight * ((curve[:-2] + curve[2:]) / 2 - curve[1:-1])
+    return curve
+
+
+def simplify_curve(curve, tolerance):
+    """
+    Ramer-Douglas-Peucker simplification: drop the points that lie within
+    tolerance of the simplified curve. Closed curves are split at the point
+    farthest from their start so that both halves keep their shape.
+    """
+    if len(curve) < 3:
+        return curve
+    if np.array_equal(curve[0], curve[-1]):
+        split = int(np.argmax(np.linalg.norm(curve - curve[0], axis=1)))
+        if split == 0:
+            return curve[:1]
+        return np.vstack([simplify_curve(curve[:split + 1], tolerance)[:-1], simplify_curve(curve[split:], tolerance)])
+
+    keep = np.zeros(len(curve), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(curve) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        chord = curve[last] - curve[first]
+        offsets = curve[first + 1:last] - curve[first]
+        length = np.linalg.norm(chord)
+        if length == 0:
+            distances = np.linalg.norm(offsets, axis=1)
+        else:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack += [(first, middle), (middle, last)]
+    return curve[keep]
+
+
+def build_contour_polydata(image_data, points, segments, smoothing=None, iterations=2, tolerance=0.0):
+    """
+    Build the contour polydata as one polyline cell per connected curve.
+    smoothing is None, 'chaikin' or 'laplacian' (applied iterations times), and
+    a tolerance > 0 (in world units) simplifies the curves afterwards.
+    """
+    # Map grid index coordinates to world coordinates (contour lies in z = 0)
+    origin = image_data.GetOrigin()
+    spacing = image_data.GetSpacing()
+    extent = image_data.GetExtent()
+    world = np.zeros((len(points), 3))
+    world[:, 0] = origin[0] + (extent[0] + points[:, 0]) * spacing[0]
+    world[:, 1] = origin[1] + (extent[2] + points[:, 1]) * spacing[1]
+
+    polylines = stitch_segments(segments, len(points))
+
+    # Unchanged points: the polylines index the shared point array directly
+    if smoothing is None and tolerance <= 0:
+        connectivity = np.array([index for polyline in polylines for index in polyline], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum([len(polyline) for polyline in polylines])])
+        return polydata_from_arrays(world, connectivity, offsets)
+
+    if smoothing not in (None, 'chaikin', 'laplacian'):
+        raise ValueError("Unknown smoothing %r, expected 'chaikin' or 'laplacian'" % smoothing)
+    curves = []
+    for polyline in polylines:
+        curve = world[polyline]
+        closed = polyline[0] == polyline[-1] and len(polyline) > 2
+        if smoothing == 'chaikin':
+            curve = chaikin_smooth(curve, closed, iterations)
+        elif smoothing == 'laplacian':
+            curve = laplacian_smooth(curve, closed, iterations)
+        if tolerance > 0:
+            curve = simplify_curve(curve, tolerance)
+        curves.append(curve)
+    return polyline_polydata(curves)
+
+
+def generate_smooth_isocontour(image_data, isovalue, smoothing=None, iterations=2, tolerance=0.0):
+    # Step 2: Extract the isocontour with vectorized marching squares
+    values = get_scalar_grid(image_data)
+    with instrument.stage("contour.marching_squares"):
+        points, segments = marching_squares(values, isovalue)
+    # Stitched into polylines, optionally smoothed and simplified
+    with instrument.stage("contour.build_polydata"):
+        return build_contour_polydata(image_data, points, segments, smoothing, iterations, tolerance)
 
     
-def write_to_vtp(output_file, contour_polydata):
+def write_to_vtp(output_file, contour_polydata, compressor='zlib'):
     # Step 3: Write the isocontour to disk as a VTKPolyData file (*.vtp)
-    writer = vtk.vtkXMLPolyDataWriter()
-    writer.SetFileName(output_file)
-    writer.SetInputData(contour_polydata)
-    writer.Write()
+    write_vtp(output_file, contour_polydata, compressor)
+
+def contour_sequence(pattern, isovalue, output_dir, compressor='zlib', depth=2):
+    # Isocontour every timestep of a .vti sequence (a glob) to output_dir/<step>.vtp
+    # plus isocontours.pvd, reading the next steps in the background
+    def process(image_data, output_stem):
+        output_file = output_stem + '.vtp'
+        write_to_vtp(output_file, generate_smooth_isocontour(image_data, isovalue), compressor)
+        return output_file
+
+    return run_sequence(pattern, read_vti_image, process, output_dir, 'isocontours.pvd', depth)
+
 
 def visualize_dataset_and_isocontour(image_data, contour_polydata):
     # Create a renderer for visualization
@@ -137,21 +319,32 @@ def visualize_dataset_and_isocontour(image_data, contour_polydata):
     render_window_interactor.Start()
 
 if __name__ == "__main__":
-    # replace 'Data\Isabel_2D.vti' with the actual file name
-    input_file = 'Data\Isabel_2D.vti'
+    # replace 'Data\Isabel_2D.vti' with the actual file name, or pass a glob
+    # such as 'Data/Isabel_2D_*.vti' to contour a time series into isocontours/
+    input_file = sys.argv[1] if len(sys.argv) > 1 else 'Data\Isabel_2D.vti'
     output_file = 'output_file_1.vtp'
     # Change the isovalue variable to desired value
     isovalue = float(input("Enter desired isovalue: "))
     # isovalue = 100
 
-    # Load the dataset
-    image_data = load_dataset(input_file)
+    if is_sequence(input_file):
+        contour_sequence(input_file, isovalue, 'isocontours')
+        sys.exit()
+
+    # Profiled when INSTRUMENT_PROFILE names an output file
+    with instrument.profile_run():
+        # Load the dataset
+        image_data = load_dataset(input_file)
+
+        # Generate the isocontour
+        contour_polydata = generate_smooth_isocontour(image_data, isovalue)
 
-    # Generate the isocontour
-    contour_polydata = generate_smooth_isocontour(image_data, isovalue)
+        # Write it out to disk as a VTKPolyData file
+        write_to_vtp(output_file, contour_polydata)
 
-    # Write it out to disk as a VTKPolyData file
-    write_to_vtp(output_file, contour_polydata)
+    # Stage timings when run with INSTRUMENT=1
+    if instrument.enabled:
+        instrument.print_summary()
 
     # Visualize the dataset and isocontour
     visualize_dataset_and_isocontour(image_data, contour_polydata)
\ No newline at end of file
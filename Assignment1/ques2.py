@@ -1,24 +1,127 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import time
+
+import numpy as np
 import vtk
+from vtk.util import numpy_support
+
+from common.sequence import run_sequence, read_vti_image, is_sequence
+from common.vti_io import load_vti
+
+# Transfer functions of the Isabel pressure field: (value, opacity) and (value, r, g, b)
+ISABEL_OPACITY_POINTS = [(-4931.54, 1.0), (101.815, 0.002), (2594.97, 0.0)]
+ISABEL_COLOR_POINTS = [(-4931.54, 0, 1, 1), (-2508.95, 0, 0, 1), (-1873.9, 0, 0, 0.5),
+                       (-1027.16, 1, 0, 0), (-298.031, 1, 0.4, 0), (2594.97, 1, 1, 0)]
 
-def create_opacity_transfer():
+# The same curves with the values given as quantiles of the data: opaque at the
+# low tail, nearly transparent from the median up, colors spread over the tail
+OPACITY_QUANTILES = [(0.0, 1.0), (0.5, 0.002), (1.0, 0.0)]
+COLOR_QUANTILES = [(0.0, 0, 1, 1), (0.005, 0, 0, 1), (0.01, 0, 0, 0.5),
+                   (0.05, 1, 0, 0), (0.25, 1, 0.4, 0), (1.0, 1, 1, 0)]
+
+
+def create_opacity_transfer(points=ISABEL_OPACITY_POINTS):
     opacity_transfer_function = vtk.vtkPiecewiseFunction()
-    opacity_transfer_function.AddPoint(-4931.54, 1.0)
-    opacity_transfer_function.AddPoint(101.815, 0.002)
-    opacity_transfer_function.AddPoint(2594.97, 0.0)
+    for value, opacity in points:
+        opacity_transfer_function.AddPoint(value, opacity)
     return opacity_transfer_function
 
 
-def create_color_transfer():
+def create_color_transfer(points=ISABEL_COLOR_POINTS):
     color_transfer_function = vtk.vtkColorTransferFunction()
-    color_transfer_function.AddRGBPoint(-4931.54, 0, 1, 1)
-    color_transfer_function.AddRGBPoint(-2508.95, 0, 0, 1)
-    color_transfer_function.AddRGBPoint(-1873.9, 0, 0, 0.5)
-    color_transfer_function.AddRGBPoint(-1027.16, 1, 0, 0)
-    color_transfer_function.AddRGBPoint(-298.031, 1, 0.4, 0)
-    color_transfer_function.AddRGBPoint(2594.97, 1, 1, 0)
+    for value, r, g, b in points:
+        color_transfer_function.AddRGBPoint(value, r, g, b)
     return color_transfer_function
 
 
+def get_volume(image_data):
+    # Point scalars as a (nz, ny, nx) NumPy view
+    dimensions = image_data.GetDimensions()
+    scalars = numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())
+    return scalars.reshape(dimensions[2], dimensions[1], dimensions[0])
+
+
+def data_transfer_points(values, opacity_quantiles=OPACITY_QUANTILES, color_quantiles=COLOR_QUANTILES,
+                         sample_size=10 ** 6):
+    """
+    Opacity and color points placed at quantiles of the data instead of fixed
+    values. The quantiles come from an evenly strided sample of about
+    sample_size values; the 0 and 1 quantiles are the exact min and max.
+    """
+    values = np.asarray(values).ravel()
+    sample = values[::max(1, len(values) // sample_size)]
+    low, high = values.min(), values.max()
+
+    def at_quantiles(quantiles):
+        positions = np.quantile(sample, quantiles)
+        return np.where(np.equal(quantiles, 0), low, np.where(np.equal(quantiles, 1), high, positions))
+
+    opacity_values = at_quantiles([point[0] for point in opacity_quantiles])
+    color_values = at_quantiles([point[0] for point in color_quantiles])
+    opacity_points = [(float(value), opacity) for value, (_, opacity) in zip(opacity_values, opacity_quantiles)]
+    color_points = [(float(value),) + tuple(color) for value, (_, *color) in zip(color_values, color_quantiles)]
+    return opacity_points, color_points
+
+
+def brick_reduce(array, block_size, axis, reduce):
+    # Reduce bricks of block_size cells along one axis, including the sample
+    # each brick shares with the next one (reduce is np.minimum or np.maximum)
+    count = max(1, -(-(array.shape[axis] - 1) // block_size))
+    pad_width = [(0, 0)] * array.ndim
+    pad_width[axis] = (0, count * block_size + 1 - array.shape[axis])
+    array = np.moveaxis(np.pad(array, pad_width, mode='edge'), axis, 0)
+    body = array[:count * block_size]
+    bricks = reduce.reduce(body.reshape((count, block_size) + body.shape[1:]), axis=1)
+    bricks = reduce(bricks, array[block_size::block_size])
+    return np.moveaxis(bricks, 0, axis)
+
+
+def block_min_max(volume, block_size=8):
+    """
+    Min and max of every brick of block_size^3 cells of a (nz, ny, nx) volume.
+    Bricks include their boundary samples, so the range of a brick bounds
+    every value interpolated inside it.
+    """
+    brick_min, brick_max = volume, volume
+    for axis in range(3):
+        brick_min = brick_reduce(brick_min, block_size, axis, np.minimum)
+        brick_max = brick_reduce(brick_max, block_size, axis, np.maximum)
+    return brick_min, brick_max
+
+
+def visible_bricks(brick_min, brick_max, opacity_points, threshold):
+    # The piecewise linear opacity peaks over [min, max] at an end or at a point inside
+    values, opacities = np.array(sorted(opacity_points)).T
+    visible = np.maximum(np.interp(brick_min, values, opacities), np.interp(brick_max, values, opacities)) > threshold
+    for value, opacity in zip(values, opacities):
+        if opacity > threshold:
+            visible |= (brick_min <= value) & (value <= brick_max)
+    return visible
+
+
+def visible_extent(image_data, opacity_points, threshold=0.01, block_size=8):
+    """
+    Extent of the bounding box of the bricks whose opacity exceeds threshold
+    somewhere (None when no brick does).
+    """
+    visible = visible_bricks(*block_min_max(get_volume(image_data), block_size), opacity_points, threshold)
+    if not visible.any():
+        return None
+
+    dimensions = image_data.GetDimensions()
+    extent = image_data.GetExtent()
+    visible_extent = []
+    # visible is indexed (z, y, x)
+    for axis, other_axes in enumerate([(0, 1), (0, 2), (1, 2)]):
+        bricks = np.flatnonzero(visible.any(axis=other_axes))
+        low = bricks[0] * block_size
+        high = min((bricks[-1] + 1) * block_size, dimensions[axis] - 1)
+        visible_extent += [extent[2 * axis] + low, extent[2 * axis] + high]
+    return visible_extent
+
+
 def set_render(volume, outline_actor):
     # Renderer and Render Window
     renderer = vtk.vtkRenderer()
@@ -47,18 +150,30 @@ def set_vp_for_phong_shading():
     volume_property.SetSpecular(0.5)
 
 
-def main_f(use_phong_shading, input):
-    # Load 3D data 
-    reader = vtk.vtkXMLImageDataReader()
-    reader.SetFileName(input)
-    
-    # Create Color and Opacity Transfer functions
-    color_transfer_function = create_color_transfer()
-    opacity_transfer_function = create_opacity_transfer()
+def build_volume_actors(image_data, use_phong_shading, data_driven=True, crop_threshold=0.01, transfer_points=None):
+    # Create Color and Opacity Transfer functions (given, from the data's quantiles or the fixed Isabel values)
+    if transfer_points is not None:
+        opacity_points, color_points = transfer_points
+    elif data_driven:
+        opacity_points, color_points = data_transfer_points(get_volume(image_data))
+    else:
+        opacity_points, color_points = ISABEL_OPACITY_POINTS, ISABEL_COLOR_POINTS
+    color_transfer_function = create_color_transfer(color_points)
+    opacity_transfer_function = create_opacity_transfer(opacity_points)
     
     # Volume Rendering
     mapper = vtk.vtkSmartVolumeMapper()
-    mapper.SetInputConnection(reader.GetOutputPort())
+    mapper.SetInputData(image_data)
+
+    # Skip the empty space around the voxels with opacity above crop_threshold:
+    # the mapper only gets the visible box, so rays start and end at its faces
+    # (cropping planes would still march the rays through the whole volume)
+    extent = visible_extent(image_data, opacity_points, crop_threshold) if crop_threshold is not None else None
+    if extent is not None:
+        visible_box = vtk.vtkExtractVOI()
+        visible_box.SetInputData(image_data)
+        visible_box.SetVOI(*extent)
+        mapper.SetInputConnection(visible_box.GetOutputPort())
 
     # Volume Property
     volume_property = vtk.vtkVolumeProperty()
@@ -79,22 +194,116 @@ def main_f(use_phong_shading, input):
 
     # Outline
     outline = vtk.vtkOutlineFilter()
-    outline.SetInputConnection(reader.GetOutputPort())
+    outline.SetInputData(image_data)
 
     outline_mapper = vtk.vtkPolyDataMapper()
     outline_mapper.SetInputConnection(outline.GetOutputPort())
 
     outline_actor = vtk.vtkActor()
     outline_actor.SetMapper(outline_mapper)
+    return volume, outline_actor
+
+
+def main_f(use_phong_shading, input, data_driven=True, crop_threshold=0.01):
+    # Load 3D data (memory-mapped, no copy)
+    image_data = load_vti(input)
 
+    volume, outline_actor = build_volume_actors(image_data, use_phong_shading, data_driven, crop_threshold)
     set_render(volume, outline_actor)
-    
+
+
+def orbit_azimuths(frames):
+    # Evenly spaced camera azimuths in degrees; 2 frames give the front and back views
+    return [360.0 * frame / frames for frame in range(frames)]
+
+
+def render_orbit(input, output_prefix, use_phong_shading=False, frames=36, size=(1000, 1000), elevation=0.0,
+                 data_driven=True, crop_threshold=0.01, transfer_points=None):
+    """
+    Render a volume (a .vti file name or vtkImageData) offscreen from camera
+    positions orbiting it and write output_prefix_000.png, output_prefix_001.png, ...
+    The reader, transfer functions and mapper are set up once; only the camera
+    moves between frames. Returns the render and PNG write time of every frame.
+    """
+    image_data = load_vti(input) if isinstance(input, str) else input
+    volume, outline_actor = build_volume_actors(image_data, use_phong_shading, data_driven, crop_threshold,
+                                                transfer_points)
+
+    renderer = vtk.vtkRenderer()
+    renderer.AddActor(volume)
+    renderer.AddActor(outline_actor)
+    renderer.SetBackground(1, 1, 1)
+
+    # No window or display is needed
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.SetSize(*size)
+    render_window.AddRenderer(renderer)
+
+    renderer.ResetCamera()
+    camera = renderer.GetActiveCamera()
+    camera.Elevation(elevation)
+    camera.OrthogonalizeViewUp()
+
+    window_image = vtk.vtkWindowToImageFilter()
+    window_image.SetInput(render_window)
+    window_image.ReadFrontBufferOff()
+    window_image.ShouldRerenderOff()  # Capture the frame that was just rendered
+    writer = vtk.vtkPNGWriter()
+    writer.SetInputConnection(window_image.GetOutputPort())
+
+    timings = []
+    previous_azimuth = 0.0
+    for frame, azimuth in enumerate(orbit_azimuths(frames)):
+        camera.Azimuth(azimuth - previous_azimuth)
+        previous_azimuth = azimuth
+        renderer.ResetCameraClippingRange()
+
+        start = time.perf_counter()
+        render_window.Render()
+        render_window.WaitForCompletion()
+        rendered = time.perf_counter()
+
+        window_image.Modified()
+        writer.SetFileName("%s_%03d.png" % (output_prefix, frame))
+        writer.Write()
+        timings.append({'frame': frame, 'azimuth': azimuth, 'render_s': rendered - start,
+                        'write_s': time.perf_counter() - rendered})
+
+    render_window.Finalize()
+    return timings
+
+
+def render_sequence(pattern, output_dir, use_phong_shading=False, frames=1, size=(1000, 1000), elevation=0.0,
+                    data_driven=True, crop_threshold=0.01, depth=2):
+    """
+    Render every timestep of a .vti sequence (a glob such as 'Data/Isabel_3D_*.vti')
+    to output_dir/<step>_000.png ... while the next steps are read in the background.
+    The transfer functions of the first step are kept for the whole sequence
+    so that colors mean the same value in every frame.
+    """
+    transfer_points = None
+
+    def process(image_data, output_stem):
+        nonlocal transfer_points
+        if transfer_points is None:
+            transfer_points = (data_transfer_points(get_volume(image_data)) if data_driven
+                               else (ISABEL_OPACITY_POINTS, ISABEL_COLOR_POINTS))
+        render_orbit(image_data, output_stem, use_phong_shading, frames, size, elevation,
+                     crop_threshold=crop_threshold, transfer_points=transfer_points)
+
+    return run_sequence(pattern, read_vti_image, process, output_dir, depth=depth)
+
 
 if __name__ == "__main__":
     
     phong_shading = input("Do you want to use Phong shading? (yes/no): ").lower() == "yes"
-    # replace 'Data/Isabel_3D.vti' with the actual file name
-    input = 'Data/Isabel_3D.vti'
+    # replace 'Data/Isabel_3D.vti' with the actual file name, or pass a glob
+    # such as 'Data/Isabel_3D_*.vti' to render a time series to renders/
+    input = sys.argv[1] if len(sys.argv) > 1 else 'Data/Isabel_3D.vti'
     # use_phong_shading = False
-    main_f(phong_shading, input)
+    if is_sequence(input):
+        render_sequence(input, 'renders', phong_shading)
+    else:
+        main_f(phong_shading, input)
 
@@ -0,0 +1,85 @@
+import numpy as np
+import vtk
+
+from ques1 import get_scalar_grid, marching_squares, build_contour_polydata
+
+
+class SpanSpaceIndex:
+    """
+    Per-cell (min, max) index of a 2D scalar grid, bucketed by cell minimum.
+    Inside each bucket the cells are sorted by their maximum, so a query only
+    touches the cells whose range contains the isovalue.
+    Build it once per dataset and reuse it for any number of isovalues.
+    """
+
+    def __init__(self, values, bucket_count=64):
+        self.values = values
+
+        # Cell min / max from the four corners of every cell
+        corners = (values[:-1, :-1], values[:-1, 1:], values[1:, 1:], values[1:, :-1])
+        cell_min = np.minimum.reduce(corners).ravel()
+        cell_max = np.maximum.reduce(corners).ravel()
+
+        # Buckets on the cell minimum, split at quantiles so they are evenly filled
+        bucket_count = max(1, min(bucket_count, len(cell_min)))
+        edges = np.quantile(cell_min, np.linspace(0, 1, bucket_count + 1)[1:-1])
+        bucket = np.searchsorted(edges, cell_min, side='right')
+
+        # Sort by bucket, then by cell max inside each bucket
+        order = np.lexsort((cell_max, bucket))
+        self.cell_ids = order
+        self.cell_min = cell_min[order]
+        self.cell_max = cell_max[order]
+        self.bucket_start = np.searchsorted(bucket[order], np.arange(bucket_count + 1))
+        # Bucket b holds the cells with bucket_edges[b] <= min < bucket_edges[b + 1]
+        self.bucket_edges = np.concatenate([[-np.inf], edges, [np.inf]])
+
+    def query(self, isovalue):
+        # Return the ids of the cells with min < isovalue < max
+        selected = []
+        for b in range(len(self.bucket_start) - 1):
+            start, end = self.bucket_start[b], self.bucket_start[b + 1]
+            if start == end:
+                continue
+            if self.bucket_edges[b] >= isovalue:
+                # Buckets are ordered by cell min, nothing further can cross
+                break
+            # Cells sorted by max: every cell after the split has max > isovalue
+            split = start + np.searchsorted(self.cell_max[start:end], isovalue, side='right')
+            if self.bucket_edges[b + 1] <= isovalue:
+                selected.append(self.cell_ids[split:end])
+            else:
+                # Bucket straddles the isovalue: check the minimum as well
+                mins = self.cell_min[split:end]
+                selected.append(self.cell_ids[split:end][mins < isovalue])
+        if not selected:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(selected))
+
+
+def build_span_space_index(image_data, bucket_count=64):
+    # Build the cell index once per dataset
+    return SpanSpaceIndex(get_scalar_grid(image_data), bucket_count)
+
+
+def generate_isocontours(image_data, isovalues, index=None):
+    """
+    Contour the dataset at every isovalue in the list.
+    Returns a dict mapping each isovalue to its vtkPolyData; the isovalue is
+    also stored in the "Isovalue" field data array of the polydata.
+    """
+    if index is None:
+        index = build_span_space_index(image_data)
+
+    contours = {}
+    for isovalue in isovalues:
+        points, segments = marching_squares(index.values, isovalue, index.query(isovalue))
+        contour_polydata = build_contour_polydata(image_data, points, segments)
+
+        tag = vtk.vtkDoubleArray()
+        tag.SetName("Isovalue")
+        tag.InsertNextValue(isovalue)
+        contour_polydata.GetFieldData().AddArray(tag)
+
+        contours[isovalue] = contour_polydata
+    return contours
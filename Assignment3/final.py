@@ -1,57 +1,346 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
 import vtk
-    
-        
-def RK4_integration(starting_point, step_size, max_steps, probe_filter):
+
+from common import instrument
+from common.sequence import run_sequence, read_vti_arrays, is_sequence, sequence_files
+from common.vti_io import load_vti_array
+from common.vtp_io import polyline_polydata, write_vtp
+
+
+class VectorField:
+    """
+    Vector field on a uniform grid, sampled with trilinear interpolation
+    computed directly from the grid origin and spacing.
+    """
+
+    def __init__(self, vectors, extent, origin, spacing):
+        self.dims = np.array([extent[1] - extent[0] + 1, extent[3] - extent[2] + 1, extent[5] - extent[4] + 1])
+        self.vectors = np.asarray(vectors).reshape(self.dims[2], self.dims[1], self.dims[0], 3)
+        self.spacing = np.array(spacing, dtype=float)
+        self.origin = np.array(origin, dtype=float) + np.array(extent[::2]) * self.spacing
+        self.bounds = np.stack([self.origin, self.origin + (self.dims - 1) * self.spacing], axis=1).ravel()
+
+    def contains(self, points):
+        # True for the points inside the bounds of the grid
+        points = np.asarray(points)
+        return np.all((points >= self.bounds[0::2]) & (points <= self.bounds[1::2]), axis=-1)
+
+    @instrument.timed("field.sample")
+    def sample(self, points):
+        # Trilinear interpolation of the vectors at (N, 3) or (3,) points
+        points = np.asarray(points, dtype=float)
+        index = (points - self.origin) / self.spacing
+        index = np.clip(index, 0, self.dims - 1)
+        i0 = np.minimum(index.astype(int), self.dims - 2)
+        f = index - i0
+        x0, y0, z0 = i0[..., 0], i0[..., 1], i0[..., 2]
+        fx, fy, fz = f[..., 0, None], f[..., 1, None], f[..., 2, None]
+
+        v = self.vectors
+        c00 = v[z0, y0, x0] * (1 - fx) + v[z0, y0, x0 + 1] * fx
+        c10 = v[z0, y0 + 1, x0] * (1 - fx) + v[z0, y0 + 1, x0 + 1] * fx
+        c01 = v[z0 + 1, y0, x0] * (1 - fx) + v[z0 + 1, y0, x0 + 1] * fx
+        c11 = v[z0 + 1, y0 + 1, x0] * (1 - fx) + v[z0 + 1, y0 + 1, x0 + 1] * fx
+        c0 = c00 * (1 - fy) + c10 * fy
+        c1 = c01 * (1 - fy) + c11 * fy
+        return c0 * (1 - fz) + c1 * fz
+
+
+def load_vector_field(filename):
+    # Load the vector field once (memory-mapped, no copy)
+    vectors, extent, origin, spacing = load_vti_array(filename)
+    return VectorField(vectors, extent, origin, spacing)
+
+
+@instrument.timed("streamline.rk4")
+def RK4_integration(starting_point, step_size, max_steps, vector_field):
     """
     Function to perform RK4 integration to trace a streamline from a given seed point.
     """
 
     streamline_points = [starting_point]
-    current_point = starting_point
-    
+    current_point = np.asarray(starting_point, dtype=float)
+
+    if not vector_field.contains(current_point):
+        return streamline_points
 
     for _ in range(max_steps):
-        # Performing the RK4 integration steps
-        probe_filter.Update()
-        output = probe_filter.GetOutput()
-        vector_data = output.GetPointData().GetVectors()
-
-        if vector_data is not None:
-            current_index = output.FindPoint(current_point)
-            
-            if current_index != -1:
-                # Using RK4 integration formulas
-                a = [2 * step_size * value for value in vector_data.GetTuple(current_index)]
-                current_index = output.FindPoint([current_point[i] + a[i]/2 for i in range(3)])
-                b = [2 * step_size * value for value in vector_data.GetTuple(current_index)]
-                current_index = output.FindPoint([current_point[i] + b[i]/2 for i in range(3)])
-                c = [2 * step_size * value for value in vector_data.GetTuple(current_index)]
-                current_index = output.FindPoint([current_point[i] + c[i]/2 for i in range(3)])
-                d = [2 * step_size * value for value in vector_data.GetTuple(current_index)]
-
-                next_point = make_next_point(current_point, a, b, c, d)
-                
-                
-                # Check if the next point is within bounds
-                bounds = output.GetBounds()
-                if (bounds[0] <= next_point[0] <= bounds[1] and 
-                    bounds[2] <= next_point[1] <= bounds[3] and 
-                    bounds[4] <= next_point[2] <= bounds[5]):
-                    streamline_points.append(next_point)
-                    current_point = next_point
-                else:
-                    break
-            else:
-                break
+        # Performing the classic RK4 integration steps
+        a = 2 * step_size * vector_field.sample(current_point)
+        b = 2 * step_size * vector_field.sample(current_point + a / 2)
+        c = 2 * step_size * vector_field.sample(current_point + b / 2)
+        d = 2 * step_size * vector_field.sample(current_point + c)
+
+        next_point = make_next_point(current_point, a, b, c, d)
+
+        # Check if the next point is within bounds
+        if vector_field.contains(next_point):
+            streamline_points.append(next_point)
+            current_point = next_point
         else:
             break
 
     return streamline_points
 
 def make_next_point(current_point, a, b, c, d):
-    next_point = [current_point[i] + (a[i] + 2*b[i] + 2*c[i] + d[i]) / 6 for i in range(3)]
+    next_point = current_point + (a + 2*b + 2*c + d) / 6
     return next_point
 
+# Dormand-Prince 5(4) coefficients
+DP_A = [
+    [],
+    [1/5],
+    [3/40, 9/40],
+    [44/45, -56/15, 32/9],
+    [19372/6561, -25360/2187, 64448/6561, -212/729],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+]
+DP_B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84])
+# Difference between the 5th and the embedded 4th order solutions
+DP_E = np.array([71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40])
+
+
+@instrument.timed("streamline.rk45")
+def RK45_integration(starting_point, step_size, max_steps, vector_field, rtol=1e-4, atol=1e-6,
+                     min_step=1e-4, max_step=None, min_speed=1e-8, max_length=np.inf, loop_tolerance=None):
+    """
+    Function to perform adaptive Dormand-Prince (RK45) integration from a given seed point.
+    The first step matches RK4_integration (2 * step_size) and the step is then
+    adapted to keep the local error within rtol / atol, between min_step and max_step
+    (one grid spacing by default: longer steps pass the local error test but
+    drift further than RK4 over long streamlines).
+    Tracing stops after max_steps accepted steps, outside the bounds, where the
+    speed drops below min_speed, beyond max_length of arc length, or when the
+    streamline comes back within loop_tolerance of its own path.
+    """
+
+    streamline_points = [starting_point]
+    current_point = np.asarray(starting_point, dtype=float)
+    if not vector_field.contains(current_point):
+        return streamline_points
+
+    if max_step is None:
+        max_step = vector_field.spacing.min()
+    direction = np.sign(step_size)
+    h = min(max(abs(2 * step_size), min_step), max_step)
+    arc_length = 0.0
+    point_lengths = [0.0]
+    visited = {}
+
+    k = [vector_field.sample(current_point)]
+    accepted = 0
+    while accepted < max_steps:
+        if np.linalg.norm(k[0]) < min_speed:
+            break
+
+        # Stages 2 to 6, then the 5th order solution and its derivative (FSAL)
+        for a in DP_A[1:]:
+            k.append(vector_field.sample(current_point + direction * h * np.dot(a, k)))
+        next_point = current_point + direction * h * np.dot(DP_B, k)
+        k.append(vector_field.sample(next_point))
+
+        error = h * np.dot(DP_E, k)
+        scale = atol + rtol * np.maximum(np.abs(current_point), np.abs(next_point))
+        error_norm = np.sqrt(np.mean((error / scale) ** 2))
+
+        if error_norm > 1 and h > min_step:
+            # Rejected: retry with a smaller step
+            h = max(h * max(0.2, 0.9 * error_norm ** -0.2), min_step)
+            k = k[:1]
+            continue
+
+        # Accepted step: check the termination criteria
+        if not vector_field.contains(next_point):
+            break
+        arc_length += np.linalg.norm(next_point - current_point)
+        if arc_length > max_length:
+            break
+        if loop_tolerance and returns_to_path(next_point, arc_length, streamline_points, point_lengths,
+                                              visited, loop_tolerance):
+            break
+
+        streamline_points.append(next_point)
+        point_lengths.append(arc_length)
+        current_point = next_point
+        accepted += 1
+
+        h = min(h * min(5.0, 0.9 * max(error_norm, 1e-10) ** -0.2), max_step)
+        k = k[-1:]
+
+    return streamline_points
+
+
+def returns_to_path(point, arc_length, streamline_points, point_lengths, visited, tolerance):
+    """
+    Check whether a point comes back within tolerance of an earlier segment of
+    the streamline, using a hash of cells of size 2 * tolerance. Each segment
+    is registered in the cells of points sampled along it at most tolerance
+    apart, so every segment within tolerance of the point is in one of the 27
+    cells around it, however long the steps are.
+    Parts of the path less than 4 * tolerance of arc length behind are ignored.
+    """
+    cell_size = 2 * tolerance
+    # Register the last segment now that it is behind the current point
+    last = len(streamline_points) - 1
+    if last > 0:
+        start = np.asarray(streamline_points[last - 1])
+        end = np.asarray(streamline_points[last])
+        samples = int(np.ceil(np.linalg.norm(end - start) / tolerance)) + 1
+        along = start + np.linspace(0, 1, samples)[:, None] * (end - start)
+        for cell in set(map(tuple, np.floor(along / cell_size).astype(int).tolist())):
+            visited.setdefault(cell, []).append(last)
+
+    cx, cy, cz = np.floor(point / cell_size).astype(int)
+    candidates = set()
+    for neighbour in [(cx + dx, cy + dy, cz + dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]:
+        candidates.update(visited.get(neighbour, ()))
+    for index in candidates:
+        # Closest point of the segment from point index - 1 to point index
+        start = np.asarray(streamline_points[index - 1])
+        segment = np.asarray(streamline_points[index]) - start
+        length = point_lengths[index] - point_lengths[index - 1]
+        t = min(max(np.dot(point - start, segment) / max(np.dot(segment, segment), 1e-300), 0.0), 1.0)
+        if (np.linalg.norm(point - start - t * segment) < tolerance
+                and arc_length - (point_lengths[index - 1] + t * length) > 4 * tolerance):
+            return True
+    return False
+
+
+@instrument.timed("streamline.trace")
+def trace_streamlines(seeds, step_size, max_steps, vector_field, integrator="rk4", **rk45_options):
+    """
+    Trace all seeds forwards and backwards in lockstep with RK4.
+    Every RK stage is evaluated for the whole (N, 3) batch at once; streamlines
+    that leave the bounds are masked out. Returns one (n, 3) array per seed,
+    the backward part reversed and joined to the forward part.
+    With integrator="rk45" each seed is traced with RK45_integration instead.
+    """
+    seeds = np.atleast_2d(np.asarray(seeds, dtype=float))
+    seed_count = len(seeds)
+
+    if integrator == "rk45":
+        streamlines = []
+        for seed in seeds:
+            forward = RK45_integration(seed, step_size, max_steps, vector_field, **rk45_options)
+            backward = RK45_integration(seed, -step_size, max_steps, vector_field, **rk45_options)
+            streamlines.append(np.array(backward[::-1] + forward[1:]))
+        return streamlines
+
+    # Forward and backward tracing in the same batch
+    positions = np.concatenate([seeds, seeds])
+    steps = np.repeat([2 * step_size, -2 * step_size], seed_count)[:, None]
+    active = np.flatnonzero(vector_field.contains(positions))
+
+    rows = [np.arange(2 * seed_count)]
+    points = [positions.copy()]
+    for _ in range(max_steps):
+        if not len(active):
+            break
+        current_point = positions[active]
+        h = steps[active]
+        a = h * vector_field.sample(current_point)
+        b = h * vector_field.sample(current_point + a / 2)
+        c = h * vector_field.sample(current_point + b / 2)
+        d = h * vector_field.sample(current_point + c)
+        next_point = make_next_point(current_point, a, b, c, d)
+
+        # Mask out the streamlines leaving the bounds
+        inside = vector_field.contains(next_point)
+        active = active[inside]
+        positions[active] = next_point[inside]
+        rows.append(active)
+        points.append(next_point[inside])
+
+    # Group the recorded points per streamline, in step order
+    rows = np.concatenate(rows)
+    points = np.concatenate(points)
+    order = np.argsort(rows, kind='stable')
+    traces = np.split(points[order], np.cumsum(np.bincount(rows, minlength=2 * seed_count))[:-1])
+
+    return [np.concatenate([traces[seed_count + k][::-1], traces[k][1:]]) for k in range(seed_count)]
+
+
+def rake_seeds(start, end, count):
+    # Seeds evenly spaced on the line from start to end
+    return np.linspace(start, end, count)
+
+
+def grid_seeds(bounds, resolution):
+    # Seeds at the cell centers of a uniform (nx, ny, nz) grid over the bounds
+    axes = [bounds[2 * k] + (np.arange(resolution[k]) + 0.5) * (bounds[2 * k + 1] - bounds[2 * k]) / resolution[k]
+            for k in range(3)]
+    z, y, x = np.meshgrid(axes[2], axes[1], axes[0], indexing='ij')
+    return np.stack([x.ravel(), y.ravel(), z.ravel()], axis=1)
+
+
+def random_seeds(bounds, count, seed=0):
+    # Seeds drawn uniformly over the bounds
+    rng = np.random.default_rng(seed)
+    return rng.uniform(bounds[0::2], bounds[1::2], size=(count, 3))
+
+
+def stratified_seeds(bounds, resolution, seed=0):
+    # One seed drawn at random inside each cell of a uniform (nx, ny, nz) grid
+    rng = np.random.default_rng(seed)
+    cell_size = (np.array(bounds[1::2]) - np.array(bounds[0::2])) / resolution
+    centers = grid_seeds(bounds, resolution)
+    return centers + rng.uniform(-0.5, 0.5, size=centers.shape) * cell_size
+
+
+def file_seeds(filename):
+    # Seeds read from a text file, one "x y z" per line
+    return np.loadtxt(filename, ndmin=2)[:, :3]
+
+
+def read_seeds(seeding_mode, bounds):
+    # Getting the user input for the chosen seeding mode
+    if seeding_mode == "rake":
+        values = list(map(float, input("Enter the rake start, end and seed count (x1 y1 z1 x2 y2 z2 n): ").split()))
+        return rake_seeds(values[0:3], values[3:6], int(values[6]))
+    if seeding_mode == "grid":
+        return grid_seeds(bounds, list(map(int, input("Enter the grid resolution (nx ny nz): ").split())))
+    if seeding_mode == "random":
+        return random_seeds(bounds, int(input("Enter the number of seeds: ")))
+    if seeding_mode == "stratified":
+        return stratified_seeds(bounds, list(map(int, input("Enter the grid resolution (nx ny nz): ").split())))
+    if seeding_mode == "file":
+        return file_seeds(input("Enter the seed file name: "))
+    return [list(map(float, input("Enter the 3D seed location (x y z): ").split()))]
+
+
+def build_streamline_polydata(streamlines):
+    # One polyline cell per streamline, built in bulk from NumPy arrays
+    return polyline_polydata(streamlines)
+
+
+def write_streamlines(output_file, poly_data, compressor='zlib'):
+    # Writing the streamlines to a compressed VTKPolyData file
+    write_vtp(output_file, poly_data, compressor)
+
+def streamline_sequence(pattern, seeds, step_size, max_steps, output_dir, integrator="rk4", workers=1, depth=2):
+    """
+    Trace the same seeds through every timestep of a vector .vti sequence
+    (a glob) and write output_dir/<step>.vtp plus streamlines.pvd, while the
+    next steps are read in the background.
+    """
+    def process(arrays, output_stem):
+        vector_field = VectorField(*arrays)
+        if workers > 1:
+            from parallel_streamlines import trace_streamlines_parallel
+            streamlines = trace_streamlines_parallel(seeds, step_size, max_steps, vector_field, workers,
+                                                     integrator=integrator)
+        else:
+            streamlines = trace_streamlines(seeds, step_size, max_steps, vector_field, integrator)
+        output_file = output_stem + '.vtp'
+        write_streamlines(output_file, build_streamline_polydata(streamlines))
+        return output_file
+
+    return run_sequence(pattern, read_vti_arrays, process, output_dir, 'streamlines.pvd', depth)
+
+
 def display_vtp_file(filename):
     # Read the VTKPolyData file
     reader = vtk.vtkXMLPolyDataReader()
@@ -91,57 +380,41 @@ def main():
     step_size = 0.05
     max_steps = 1000
     
-    # Loading the vector field dataset
-    reader = vtk.vtkXMLImageDataReader()
-    reader.SetFileName("tornado3d_vector.vti")
-    reader.Update()
-
-    # Creating a probe filter
-    probe_filter = vtk.vtkProbeFilter()
-    probe_filter.SetInputConnection(reader.GetOutputPort())
-
-    # Getting the user input for seed location
-    seed_3D_location = list(map(float, input("Enter the 3D seed location (x y z): ").split()))
+    # Loading the vector field dataset (a glob such as 'tornado3d_vector_*.vti'
+    # traces a time series into streamlines/, seeded from its first step)
+    input_file = sys.argv[1] if len(sys.argv) > 1 else "tornado3d_vector.vti"
+    sequence = is_sequence(input_file)
+    vector_field = load_vector_field(sequence_files(input_file)[0] if sequence else input_file)
 
+    # Getting the user input for the seeding mode
+    seeding_mode = input("Seeding mode (point/rake/grid/random/stratified/file): ").strip().lower()
+    seeds = read_seeds(seeding_mode, vector_field.bounds)
+    integrator = input("Integrator (rk4/rk45): ").strip().lower()
+    workers = int(input("Number of worker processes (1 for serial): ") or 1)
 
+    if sequence:
+        streamline_sequence(input_file, seeds, step_size, max_steps, "streamlines", integrator, workers)
+        return
 
-    # Tracing the streamline forwards
-    probe_filter.SetSourceConnection(reader.GetOutputPort())
-    forward_streamline = RK4_integration(seed_3D_location, step_size, max_steps, probe_filter)
-
-    # Tracing the streamline backwards
-    probe_filter.SetSourceConnection(reader.GetOutputPort())
-    backward_streamline = RK4_integration(seed_3D_location, -step_size, max_steps, probe_filter)[::-1]
-
-    # Combine forward and backward streamlines into a single streamline
-    streamline_points = backward_streamline + forward_streamline[1:]
-
-    # Create a vtkPolyData to store the streamline
-    poly_data = vtk.vtkPolyData()
-    lines = vtk.vtkCellArray()
-
-    # Convert streamline points to VTK points
-    vtk_points = vtk.vtkPoints()
-    for point in streamline_points:
-        vtk_points.InsertNextPoint(point)
+    # Profiled when INSTRUMENT_PROFILE names an output file
+    with instrument.profile_run():
+        # Tracing all streamlines forwards and backwards in one batch
+        if workers > 1:
+            from parallel_streamlines import trace_streamlines_parallel
+            streamlines = trace_streamlines_parallel(seeds, step_size, max_steps, vector_field, workers,
+                                                     integrator=integrator)
+        else:
+            streamlines = trace_streamlines(seeds, step_size, max_steps, vector_field, integrator)
 
-    # Connect points into lines
-    line_ids = list(range(len(streamline_points)))
-    line_ids.pop(0)  # Remove the first point
-    for i, j in zip(line_ids[:-1], line_ids[1:]):
-        line = vtk.vtkLine()
-        line.GetPointIds().SetId(0, i - 1)
-        line.GetPointIds().SetId(1, j)
-        lines.InsertNextCell(line)
+        # Create a vtkPolyData with one polyline per streamline
+        poly_data = build_streamline_polydata(streamlines)
 
-    poly_data.SetPoints(vtk_points)
-    poly_data.SetLines(lines)
+        # Writing the streamline to a VTKPolyData file
+        write_streamlines("streamline_output.vtp", poly_data)
 
-    # Writing the streamline to a VTKPolyData file
-    writer = vtk.vtkXMLPolyDataWriter()
-    writer.SetFileName("streamline_output.vtp")
-    writer.SetInputData(poly_data)
-    writer.Write()
+    # Stage timings when run with INSTRUMENT=1
+    if instrument.enabled:
+        instrument.print_summary()
 
     # Displaying the VTKPolyData file Output
     display_vtp_file("streamline_output.vtp")
@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from final import VectorField, trace_streamlines, build_streamline_polydata
+
+# Vector field attached by each worker process
+worker_field = None
+worker_memory = None
+
+
+def attach_shared_field(name, shape, dtype, dims, origin, spacing):
+    # Pool initializer: map the shared vector buffer once per worker
+    global worker_field, worker_memory
+    worker_memory = shared_memory.SharedMemory(name=name)
+    vectors = np.ndarray(shape, dtype=dtype, buffer=worker_memory.buf)
+    extent = (0, dims[0] - 1, 0, dims[1] - 1, 0, dims[2] - 1)
+    worker_field = VectorField(vectors, extent, origin, spacing)
+
+
+def trace_chunk(seeds, step_size, max_steps, integrator, rk45_options):
+    # Trace one chunk of seeds against the shared field
+    return trace_streamlines(seeds, step_size, max_steps, worker_field, integrator, **rk45_options)
+
+
+def trace_streamlines_parallel(seeds, step_size, max_steps, vector_field, workers=None, chunk_size=256,
+                               integrator="rk4", **rk45_options):
+    """
+    Process-pool version of trace_streamlines.
+    The vector field is placed in shared memory once, the seeds are split into
+    chunks and traced across the pool; the streamlines come back in seed order,
+    identical to the serial path.
+    """
+    seeds = np.atleast_2d(np.asarray(seeds, dtype=float))
+    chunks = [seeds[start:start + chunk_size] for start in range(0, len(seeds), chunk_size)]
+    workers = workers or os.cpu_count()
+    vectors = vector_field.vectors
+
+    memory = shared_memory.SharedMemory(create=True, size=vectors.nbytes)
+    try:
+        shared_vectors = np.ndarray(vectors.shape, dtype=vectors.dtype, buffer=memory.buf)
+        shared_vectors[:] = vectors
+        initargs = (memory.name, vectors.shape, vectors.dtype, tuple(vector_field.dims),
+                    tuple(vector_field.origin), tuple(vector_field.spacing))
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach_shared_field, initargs=initargs) as pool:
+            # map keeps the chunk order, so the output order is deterministic
+            results = pool.map(trace_chunk, chunks, [step_size] * len(chunks), [max_steps] * len(chunks),
+                               [integrator] * len(chunks), [rk45_options] * len(chunks))
+            streamlines = [line for chunk in results for line in chunk]
+        del shared_vectors
+    finally:
+        memory.close()
+        memory.unlink()
+
+    return streamlines
+
+
+def trace_streamlines_polydata_parallel(seeds, step_size, max_steps, vector_field, workers=None, chunk_size=256,
+                                        integrator="rk4", **rk45_options):
+    # Gather the parallel streamlines into one ordered polydata
+    streamlines = trace_streamlines_parallel(seeds, step_size, max_steps, vector_field, workers, chunk_size,
+                                             integrator, **rk45_options)
+    return build_streamline_polydata(streamlines)
@@ -1,16 +1,64 @@
-import pandas as pd
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 import plotly.express as px
 import plotly.graph_objects as go
-from dash import Dash, html, dcc, Input, Output
+from dash import Dash, html, dcc, Input, Output, Patch
 
-# Step 1: Read the dataset
-df = pd.read_csv("co-emissions-per-capita.csv")
+from emissions_data import load_emissions
+from figure_cache import memoize
+from common import instrument
 
-# Step 2: Filter data for year 2022
-df_2022 = df[df['Year'] == 2022].copy()  # Make a copy to avoid SettingWithCopyWarning
+# Step 1: Read the dataset (from the shared binary cache of both CSVs)
+df = load_emissions()
+df = df[df["in_per_capita"]]
 
-# Round the "Annual CO₂ Emissions per Capita (2022)" to 1 decimal place using .loc indexer
-df_2022.loc[:, "Annual CO₂ emissions (per capita)"] = df_2022["Annual CO₂ emissions (per capita)"].round(1)
+# Precompute the per-entity time series so each hover is a dict lookup
+trend_by_entity = {
+    entity: (group["Year"].to_numpy(), group["Annual CO₂ emissions (per capita)"].to_numpy())
+    for entity, group in df.groupby("Entity", sort=False, observed=True)
+}
+
+# Trend data sent for one country (memoized per country)
+@memoize(maxsize=512)
+def trend_series(country_name):
+    years, values = trend_by_entity.get(country_name, ([], []))
+    # Shortest decimal of each float32 (0.0016306345, not 0.0016306345351040363)
+    return list(map(int, years)), [float(str(value)) for value in values]
+
+# World map of one year (also used by export_figures.py for the static reports)
+def build_map_figure(year):
+    # Step 2: Filter data for the year
+    df_year = df[df['Year'] == year].copy()  # Make a copy to avoid SettingWithCopyWarning
+
+    # Round the "Annual CO₂ Emissions per Capita" to 1 decimal place using .loc indexer
+    df_year.loc[:, "Annual CO₂ emissions (per capita)"] = df_year["Annual CO₂ emissions (per capita)"].round(1)
+
+    return px.choropleth(
+        df_year,
+        locations="Entity",
+        locationmode="country names",
+        color="Annual CO₂ emissions (per capita)",
+        projection="natural earth",
+        hover_name="Entity",
+        hover_data={"Entity":False ,"Annual CO₂ emissions (per capita)": True},  # Remove "Entity" from hover info
+        title=f"Annual CO₂ Emissions per Capita ({year}) (in tonnes per person)",
+        color_continuous_scale=px.colors.sequential.YlOrBr,  # Change color scale
+        range_color=(0, 20),  # Set color range from 0 to 20t
+    )
+
+# Create the world map of 2022 once at startup
+map_fig = build_map_figure(2022)
+
+# Empty trend chart; hover callbacks only patch its data
+mini_fig = go.Figure(go.Scatter(
+    x=[],
+    y=[],
+    mode="lines+markers",
+    name="CO₂ emissions trend",
+    marker=dict(size=1)  # Adjust the marker size here
+))
+mini_fig.update_layout(width=600, height=200, margin=dict(t=10))
 
 # Step 3: Create a Plotly Dash app
 app = Dash(__name__)
@@ -27,56 +75,46 @@ app = Dash(__name__)
 
 app.layout = html.Div([
     html.Div([
-        dcc.Graph(id="map-graph", style={'height': '80vh'}),  # Adjust height of the map
+        dcc.Graph(id="map-graph", figure=map_fig, style={'height': '80vh'}),  # Static map, sent once
         html.Div(id="mini-graph-heading", style={'text-align': 'center', 'font-size': '16px'}),  # Align text to center
-        html.Div(id="mini-graph-container", style={'text-align': 'center'})  # Align the container to center
+        html.Div([
+            dcc.Graph(id="mini-graph", figure=mini_fig, style={'display': 'inline-block'})
+        ], id="mini-graph-container", style={'text-align': 'center', 'display': 'none'})  # Align the container to center
     ], style={'width': '100%', 'display': 'inline-block', 'vertical-align': 'top', 'margin-bottom': '10px'})  # Adjust margin-bottom
 ])
 
 @app.callback(
-    Output("map-graph", "figure"),
     Output("mini-graph-heading", "children"),
-    Output("mini-graph-container", "children"),
+    Output("mini-graph", "figure"),
+    Output("mini-graph-container", "style"),
     Input("map-graph", "hoverData")
 )
+@instrument.timed("update_map")
 def update_map(hoverData):
-    # Create the world map
-    fig = px.choropleth(
-        df_2022,
-        locations="Entity",
-        locationmode="country names",
-        color="Annual CO₂ emissions (per capita)",
-        projection="natural earth",
-        hover_name="Entity",
-        hover_data={"Entity":False ,"Annual CO₂ emissions (per capita)": True},  # Remove "Entity" from hover info
-        title="Annual CO₂ Emissions per Capita (2022) (in tonnes per person)",
-        color_continuous_scale=px.colors.sequential.YlOrBr,  # Change color scale
-        range_color=(0, 20),  # Set color range from 0 to 20t
-    )
-
     mini_graph_heading = ""
-    mini_graph_div = None
+    mini_graph_patch = Patch()
+    container_style = {'text-align': 'center', 'display': 'none'}
 
     if hoverData is not None and "points" in hoverData:
         # Extract country name from hoverData
         country_name = hoverData["points"][0]["hovertext"]
 
-        # Step 4: Implement hover functionality
-        country_df = df[df["Entity"] == country_name]
-        mini_graph = go.Scatter(
-            x=country_df["Year"],
-            y=country_df["Annual CO₂ emissions (per capita)"],
-            mode="lines+markers",
-            name="CO₂ emissions trend",
-            marker=dict(size=1)  # Adjust the marker size here
-        )
-        mini_fig = go.Figure(mini_graph)
-        mini_fig.update_layout(width=600, height=200, margin=dict(t=10))
-        mini_graph_div = dcc.Graph(figure=mini_fig)
+        # Step 4: Implement hover functionality (only the trend data is sent)
+        with instrument.stage("update_map.trend"):
+            years, values = trend_series(country_name)
+        mini_graph_patch["data"][0]["x"] = years
+        mini_graph_patch["data"][0]["y"] = values
+        container_style = {'text-align': 'center'}
 
         mini_graph_heading = html.H5("CO₂ emissions (per capita) trend - " + country_name)
 
-    return fig, mini_graph_heading, mini_graph_div
+    return mini_graph_heading, mini_graph_patch, container_style
+
+# WSGI entry point for production, with the data loaded once before forking, e.g.
+#   gunicorn --preload --workers 4 CO2_emission_per_capita:server
+# Set FIGURE_CACHE_DIR to share memoized trends between the workers, and
+# INSTRUMENT=1 to time every request (callback plus serialization).
+server = instrument.instrument_server(app.server)
 
 if __name__ == "__main__":
     app.run_server(debug=True)
@@ -1,27 +1,43 @@
-import pandas as pd
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output
-import plotly.graph_objs as go
 
-# Read the dataset
-df = pd.read_csv("per-capita-co2-by-source.csv")
+from emissions_data import load_emissions
+from figure_cache import memoize
+from common import instrument
 
-# Rename columns
-df.rename(columns={
-    "Annual CO₂ emissions from coal (per capita)": "coal",
-    "Annual CO₂ emissions from oil (per capita)": "oil",
-    "Annual CO₂ emissions from gas (per capita)": "gas",
-    "Annual CO₂ emissions from flaring (per capita)": "flaring",
-    "Annual CO₂ emissions from cement (per capita)": "cement",
-    "Annual CO₂ emissions from other industry (per capita)": "other"
-}, inplace=True)
+# Read the dataset (from the shared binary cache of both CSVs, sources already renamed)
+df = load_emissions()
+df = df[df['in_by_source']].copy()
 
 # Calculate total CO₂ emissions for each entity
 df['Total CO₂ emissions'] = df[['coal', 'oil', 'gas', 'flaring', 'cement', 'other']].sum(axis=1)
 
 # Get unique entities
-entities = df['Entity'].unique()
+entities = np.asarray(df['Entity'].unique())
+
+# Pivot the data once into a dense (year x entity x source) cube so that any
+# selection is a direct slice instead of a boolean filter over the whole frame
+sources = ['coal', 'oil', 'gas', 'flaring', 'cement', 'other']
+colors = ['#606060', '#9C0000', '#800070', '#A52A2A', '#008000', '#0000AA']  # Black, Red, Purple, Brown, Green, Blue
+first_year = int(df['Year'].min())
+year_count = int(df['Year'].max()) - first_year + 1
+entity_index = {entity: i for i, entity in enumerate(entities)}
+
+year_rows = df['Year'].to_numpy() - first_year
+entity_rows = df['Entity'].map(entity_index).to_numpy()
+emission_cube = np.full((year_count, len(entities), len(sources)), np.nan, dtype=np.float32)
+emission_cube[year_rows, entity_rows] = df[sources].to_numpy(dtype=np.float32)
+entity_present = np.zeros((year_count, len(entities)), dtype=bool)  # Entity has a row for that year
+entity_present[year_rows, entity_rows] = True
+
+# Send the cube to the browser once and update the chart there while dragging
+use_clientside_callback = os.environ.get("CLIENTSIDE_SLIDER", "0") == "1"
 
 # Sort the DataFrame based on total CO₂ emissions
 df_sorted = df.sort_values(by='Total CO₂ emissions', ascending=True)
@@ -47,39 +63,51 @@ app.layout = html.Div([
     dcc.Graph(id='bar-chart'),
     dcc.Slider(
         id='year-slider',
-        min=df['Year'].min(),
-        max=df['Year'].max(),
+        min=first_year,
+        max=first_year + year_count - 1,
         step=1,
         value=2022,
-        marks={df['Year'].min(): str(df['Year'].min()), df['Year'].max(): str(df['Year'].max())},
+        marks={first_year: str(first_year), first_year + year_count - 1: str(first_year + year_count - 1)},  # Plain ints serialize as JSON keys
         included=False,
         updatemode='drag'  # Ensure smooth slider behavior
     ),
     html.Div(id='slider-output-container')
-])
+] + ([dcc.Store(id='emission-cube', data={
+    'first_year': first_year,
+    'entities': list(entities),
+    'sources': sources,
+    'colors': colors,
+    'present': entity_present.astype(int).ravel().tolist(),
+    # Only the (year, entity) rows that exist, in year-major order
+    'values': [None if np.isnan(v) else round(float(v), 4) for v in emission_cube[entity_present].ravel()],
+})] if use_clientside_callback else []))
 
 # Define callback to update the bar chart based on selected countries
-@app.callback(
-    Output('bar-chart', 'figure'),
-    [Input('country-dropdown', 'value'),
-     Input('year-slider', 'value')]
-)
+# (memoized on the entity set and year; the bar order does not depend on the selection order)
+@memoize(maxsize=1024, key=lambda selected_entities, selected_year: (tuple(sorted(selected_entities or [])), selected_year))
+@instrument.timed("update_bar_chart.build")  # Cache misses only
 def update_bar_chart(selected_entities, selected_year):
-    # Filter data for selected year and entities
-    selected_data = df[(df['Entity'].isin(selected_entities)) & (df['Year'] == selected_year)].copy()
+    # Slice the selected year and entities out of the cube (entities keep the data order)
+    year = selected_year - first_year
+    selected = np.sort(np.array([entity_index[entity] for entity in selected_entities or [] if entity in entity_index],
+                               dtype=int))
+    selected = selected[entity_present[year, selected]]
+    selected_values = emission_cube[year, selected]
+    selected_names = entities[selected]
     
     # Create traces for each source
     traces_sources = []
-    colors = ['#606060', '#9C0000', '#800070', '#A52A2A', '#008000', '#0000AA']  # Black, Red, Purple, Brown, Green, Blue
-    for i, source_column in enumerate(['coal', 'oil', 'gas', 'flaring', 'cement', 'other']):
-        hover_text = [f"{source_column}: {value:.2f}" if value >= 1 else "" for value in selected_data[source_column]]  # Custom hover text
-        column_text = [f"{value:.2f}t" if value >= 1 else "" for value in selected_data[source_column]]  # Custom text for columns
+    for i, source_column in enumerate(sources):
+        values = selected_values[:, i]
+        column_text = np.where(values >= 1, np.char.mod("%.2ft", values), "")  # Custom text for columns
         
         # Define hover template
         hover_template = f"%{{x:.2f}}t:<br>"
-        trace = go.Bar(
-            y=selected_data['Entity'],
-            x=selected_data[source_column],
+        # Plain trace dicts skip plotly's per-property validation
+        trace = dict(
+            type='bar',
+            y=selected_names,
+            x=values,
             orientation='h',
             name=source_column,
             marker=dict(color=colors[i]),  # Apply custom color
@@ -90,16 +118,87 @@ def update_bar_chart(selected_entities, selected_year):
         traces_sources.append(trace)
 
     # Create layout
-    layout = go.Layout(
-        title=f'Per Capita CO₂ Emissions by Source ({selected_year}) (in tonnes per person)',
-        xaxis=dict(title='Total CO₂ Emissions (Metric Tons)'),
-        yaxis=dict(title='Country'),
+    layout = dict(
+        title=dict(text=f'Per Capita CO₂ Emissions by Source ({selected_year}) (in tonnes per person)'),
+        xaxis=dict(title=dict(text='Total CO₂ Emissions (Metric Tons)')),
+        yaxis=dict(title=dict(text='Country')),
         barmode='stack'  # Stack bars on top of each other
     )
 
     # Create and return the figure
     return {'data': traces_sources, 'layout': layout}
 
-# Run the app
+
+# Same figure built in the browser from the stored cube (no server round trip)
+clientside_bar_chart = """
+function(selectedEntities, selectedYear, cube) {
+    const year = selectedYear - cube.first_year;
+    const entityCount = cube.entities.length;
+    const sourceCount = cube.sources.length;
+    const selected = new Set(selectedEntities || []);
+    // Position of the year's first stored row
+    let row = 0;
+    for (let k = 0; k < year * entityCount; k++) {
+        row += cube.present[k];
+    }
+    const entities = [];
+    const rows = [];
+    cube.entities.forEach(function(entity, e) {
+        if (cube.present[year * entityCount + e]) {
+            if (selected.has(entity)) {
+                entities.push(entity);
+                rows.push(row);
+            }
+            row += 1;
+        }
+    });
+    const traces = cube.sources.map(function(source, s) {
+        const values = rows.map(function(r) { return cube.values[r * sourceCount + s]; });
+        return {
+            type: 'bar',
+            y: entities,
+            x: values,
+            orientation: 'h',
+            name: source,
+            marker: {color: cube.colors[s]},
+            hoverinfo: 'none',
+            hovertemplate: '%{x:.2f}t:<br>',
+            text: values.map(function(v) { return v !== null && v >= 1 ? v.toFixed(2) + 't' : ''; })
+        };
+    });
+    return {
+        data: traces,
+        layout: {
+            title: {text: 'Per Capita CO₂ Emissions by Source (' + selectedYear + ') (in tonnes per person)'},
+            xaxis: {title: {text: 'Total CO₂ Emissions (Metric Tons)'}},
+            yaxis: {title: {text: 'Country'}},
+            barmode: 'stack'
+        }
+    };
+}
+"""
+
+if use_clientside_callback:
+    app.clientside_callback(
+        clientside_bar_chart,
+        Output('bar-chart', 'figure'),
+        [Input('country-dropdown', 'value'),
+         Input('year-slider', 'value'),
+         Input('emission-cube', 'data')]
+    )
+else:
+    app.callback(
+        Output('bar-chart', 'figure'),
+        [Input('country-dropdown', 'value'),
+         Input('year-slider', 'value')]
+    )(update_bar_chart)
+
+# WSGI entry point for production, with the data loaded once before forking, e.g.
+#   gunicorn --preload --workers 4 emission_by_source:server
+# Set FIGURE_CACHE_DIR to share memoized figures between the workers, and
+# INSTRUMENT=1 to time every request (callback plus serialization).
+server = instrument.instrument_server(app.server)
+
+# Run the app (development server)
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Source files, next to this module unless EMISSIONS_DATA_DIR points elsewhere
+data_dir = os.environ.get("EMISSIONS_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+per_capita_csv = os.path.join(data_dir, "co-emissions-per-capita.csv")
+by_source_csv = os.path.join(data_dir, "per-capita-co2-by-source.csv")
+cache_file = os.path.join(data_dir, "emissions_cache.npz")
+
+per_capita_column = "Annual CO₂ emissions (per capita)"
+source_columns = {
+    "Annual CO₂ emissions from coal (per capita)": "coal",
+    "Annual CO₂ emissions from oil (per capita)": "oil",
+    "Annual CO₂ emissions from gas (per capita)": "gas",
+    "Annual CO₂ emissions from flaring (per capita)": "flaring",
+    "Annual CO₂ emissions from cement (per capita)": "cement",
+    "Annual CO₂ emissions from other industry (per capita)": "other",
+}
+value_columns = [per_capita_column] + list(source_columns.values())
+
+
+def source_signature():
+    # Modification time and size of both CSVs; any change invalidates the cache
+    return np.array([value for path in (per_capita_csv, by_source_csv)
+                     for value in (os.stat(path).st_mtime_ns, os.stat(path).st_size)], dtype=np.int64)
+
+
+def build_emissions_cache():
+    """
+    Parse both CSVs once and join them on (Entity, Year).
+    Entities and codes are stored as integer codes into their category lists,
+    the values as float32, and everything is written to one .npz file.
+    """
+    per_capita = pd.read_csv(per_capita_csv)
+    by_source = pd.read_csv(by_source_csv).rename(columns=source_columns)
+    joined = per_capita.merge(by_source.drop(columns="Code"), on=["Entity", "Year"], how="outer", indicator=True)
+
+    # Entities keep their order of appearance in the files
+    entities = pd.unique(pd.concat([per_capita["Entity"], by_source["Entity"]]))
+    entity = pd.Categorical(joined["Entity"], categories=entities)
+    order = np.lexsort((joined["Year"].to_numpy(), entity.codes))
+    joined = joined.iloc[order]
+    entity = entity[order]
+    code = pd.Categorical(joined["Code"])
+
+    arrays = dict(
+        signature=source_signature(),
+        entities=np.asarray(entities, dtype=str),
+        entity_codes=entity.codes.astype(np.int16),
+        codes=np.asarray(code.categories, dtype=str),
+        code_codes=code.codes.astype(np.int16),
+        year=joined["Year"].to_numpy(dtype=np.int16),
+        in_per_capita=joined["_merge"].isin(["both", "left_only"]).to_numpy(),
+        in_by_source=joined["_merge"].isin(["both", "right_only"]).to_numpy(),
+        values=joined[value_columns].to_numpy(dtype=np.float32),
+    )
+    # Write to a temporary file first so concurrent readers never see a partial cache
+    temporary_file = "%s.%d.tmp.npz" % (cache_file[:-4], os.getpid())
+    np.savez(temporary_file, **arrays)
+    os.replace(temporary_file, cache_file)
+    return arrays
+
+
+def load_emissions():
+    """
+    Load the joined emissions table, rebuilding the cache if either CSV changed.
+    Columns: Entity and Code (categorical), Year (int16), the per-capita total
+    and the six sources (float32), and in_per_capita / in_by_source flags
+    telling which file each (Entity, Year) row came from.
+    """
+    arrays = None
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            if np.array_equal(cached["signature"], source_signature()):
+                arrays = {name: cached[name] for name in cached.files}
+    if arrays is None:
+        arrays = build_emissions_cache()
+
+    table = pd.DataFrame({
+        "Entity": pd.Categorical.from_codes(arrays["entity_codes"], categories=arrays["entities"]),
+        "Code": pd.Categorical.from_codes(arrays["code_codes"], categories=arrays["codes"]),
+        "Year": arrays["year"],
+    })
+    for i, column in enumerate(value_columns):
+        table[column] = arrays["values"][:, i]
+    table["in_per_capita"] = arrays["in_per_capita"]
+    table["in_by_source"] = arrays["in_by_source"]
+    return table
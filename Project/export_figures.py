@@ -0,0 +1,162 @@
+"""
+Export the dashboard figures as static files for the yearly reports.
+
+    python export_figures.py --years 1750-2022 --formats html png --output-dir reports
+    python export_figures.py --years 2022 --entity-set asia=China,India,Japan
+
+For every year this writes the per-capita world map (map_<year>) and the
+by-source bar chart of every entity set (sources_<set>_<year>), built by
+the dashboards' own figure builders across a process pool. Each worker
+loads the data once. A figure whose content hash matches the manifest of
+the previous export is not written again.
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+
+manifest_name = "export_manifest.json"
+
+# Dashboard modules imported once by each worker process
+per_capita_app = None
+by_source_app = None
+
+
+def load_figure_builders():
+    # Pool initializer: importing the dashboards loads the shared data
+    global per_capita_app, by_source_app
+    import CO2_emission_per_capita
+    import emission_by_source
+    per_capita_app, by_source_app = CO2_emission_per_capita, emission_by_source
+
+
+def build_figure(kind, year, entities):
+    if kind == 'map':
+        return per_capita_app.build_map_figure(year)
+    # The callback without its memoization; None selects the dashboard's default entities
+    figure = by_source_app.update_bar_chart.__wrapped__(
+        by_source_app.default_entities if entities is None else entities, year)
+    return go.Figure(figure)
+
+
+def export_figure(task):
+    """
+    Build one figure and write it in every format, unless the same figure
+    was already written with the same hash (of the figure and the options of
+    that format). Returns {file: hash} and the number of files written.
+    """
+    name, kind, year, entities, output_dir, formats, size, plotlyjs, previous = task
+    figure = build_figure(kind, year, entities)
+    content = figure.to_json() + repr(size)
+
+    hashes = {}
+    written = 0
+    for output_format in formats:
+        # How plotly.js is included only changes the HTML files
+        options = repr(plotlyjs) if output_format == 'html' else ''
+        digest = hashlib.sha256((content + options).encode("utf-8")).hexdigest()
+        filename = "%s.%s" % (name, output_format)
+        path = os.path.join(output_dir, filename)
+        hashes[filename] = digest
+        if previous.get(filename) == digest and os.path.exists(path):
+            continue
+        if output_format == 'html':
+            pio.write_html(figure, path, include_plotlyjs=plotlyjs, full_html=True,
+                           default_width=size[0], default_height=size[1])
+        else:
+            pio.write_image(figure, path, format=output_format, width=size[0], height=size[1])
+        written += 1
+    return hashes, written
+
+
+def parse_years(text):
+    # "1750-2022", "2000,2010,2022" or a mix of both
+    years = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        years += range(int(first), int(last or first) + 1)
+    return years
+
+
+def parse_entity_set(text):
+    # "name=Entity A,Entity B"
+    name, _, entities = text.partition('=')
+    if not entities:
+        raise argparse.ArgumentTypeError("expected NAME=Entity,Entity,...")
+    return re.sub(r'[^\w-]+', '_', name), [entity.strip() for entity in entities.split(',')]
+
+
+def export_figures(years, entity_sets, output_dir, formats=('html',), size=(1200, 700), plotlyjs='directory',
+                   workers=None, force=False):
+    """
+    Export the map and the bar charts of every year across a process pool.
+    entity_sets maps a set name to a list of entities (None for the
+    dashboard's default selection). Returns (files written, files skipped).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_file = os.path.join(output_dir, manifest_name)
+    previous = {}
+    if os.path.exists(manifest_file) and not force:
+        with open(manifest_file) as f:
+            previous = json.load(f)
+
+    # The HTML files share one plotly.js bundle next to them
+    if 'html' in formats and plotlyjs == 'directory':
+        bundle = os.path.join(output_dir, "plotly.min.js")
+        if not os.path.exists(bundle):
+            with open(bundle, 'w', encoding='utf-8') as f:
+                f.write(get_plotlyjs())
+
+    figures = [("map_%d" % year, 'map', year, None) for year in years]
+    figures += [("sources_%s_%d" % (set_name, year), 'sources', year, entities)
+                for set_name, entities in entity_sets.items() for year in years]
+    tasks = [(name, kind, year, entities, output_dir, tuple(formats), tuple(size), plotlyjs,
+              {filename: digest for filename, digest in previous.items() if filename.startswith(name + '.')})
+             for name, kind, year, entities in figures]
+
+    manifest = dict(previous)
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=load_figure_builders) as pool:
+        for hashes, count in pool.map(export_figure, tasks, chunksize=4):
+            manifest.update(hashes)
+            written += count
+
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return written, len(tasks) * len(formats) - written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the dashboard figures to static HTML or images.")
+    parser.add_argument('--years', default="1750-2022", help="e.g. 1750-2022 or 2000,2010,2020-2022")
+    parser.add_argument('--entity-set', type=parse_entity_set, action='append', default=[],
+                        metavar='NAME=ENTITY,...', help="bar chart selection (default: the dashboard's default)")
+    parser.add_argument('--formats', nargs='+', choices=['html', 'png', 'svg', 'pdf'], default=['html'])
+    parser.add_argument('--output-dir', default='reports')
+    parser.add_argument('--size', type=int, nargs=2, default=(1200, 700), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--plotlyjs', choices=['directory', 'cdn', 'inline'], default='directory',
+                        help="how the HTML files get plotly.js (default: one shared file in the output directory)")
+    parser.add_argument('--workers', type=int, help="processes (default: one per CPU)")
+    parser.add_argument('--force', action='store_true', help="rewrite every file, ignoring the manifest")
+    args = parser.parse_args()
+
+    # Static images need kaleido
+    if set(args.formats) - {'html'} and importlib.util.find_spec("kaleido") is None:
+        parser.error("png, svg and pdf export need the kaleido package (pip install kaleido)")
+
+    entity_sets = dict(args.entity_set) or {'default': None}
+    plotlyjs = True if args.plotlyjs == 'inline' else args.plotlyjs
+    written, skipped = export_figures(parse_years(args.years), entity_sets, args.output_dir, args.formats,
+                                      args.size, plotlyjs, args.workers, args.force)
+    print("%d files written, %d unchanged" % (written, skipped))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import functools
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from emissions_data import source_signature
+
+# Directory of the disk-backed store shared by all worker processes (disabled when unset)
+cache_dir = os.environ.get("FIGURE_CACHE_DIR")
+# Maximum number of entries kept on disk before the least recently used are evicted
+disk_max_entries = int(os.environ.get("FIGURE_CACHE_DISK_ENTRIES", "4096"))
+
+
+class DiskStore:
+    """
+    Pickled callback outputs in a directory shared across worker processes.
+    Files are written atomically; reads refresh the file time so that eviction
+    removes the least recently used entries first.
+    """
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".pkl")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+            return value
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key, value):
+        path = self.path(key)
+        temporary_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(temporary_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+
+        # Checking the size on every write would list the directory each time
+        self.writes += 1
+        if self.writes % 64 == 0:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.directory, name)), name))
+                except OSError:
+                    pass
+        entries.sort()
+        for _, name in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+disk_store = DiskStore(cache_dir, disk_max_entries) if cache_dir else None
+
+# Version of the source CSVs the outputs were computed from; part of every key so
+# that the shared disk store never serves figures of older data after an update
+data_version = hashlib.sha1(source_signature().tobytes()).hexdigest()[:16]
+
+
+def memoize(maxsize=256, key=None):
+    """
+    Memoize a callback's output in a size-bounded in-process LRU, backed by the
+    shared disk store when FIGURE_CACHE_DIR is set.
+    key turns the callback arguments into a hashable cache key
+    (by default the arguments themselves).
+    """
+    def decorator(func):
+        entries = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            cache_key = (data_version, func.__module__, func.__name__, key(*args) if key else args)
+
+            with lock:
+                if cache_key in entries:
+                    entries.move_to_end(cache_key)
+                    return entries[cache_key]
+
+            value = disk_store.get(cache_key) if disk_store else None
+            if value is None:
+                value = func(*args)
+                if disk_store:
+                    disk_store.put(cache_key, value)
+
+            with lock:
+                entries[cache_key] = value
+                if len(entries) > maxsize:
+                    entries.popitem(last=False)
+            return value
+
+        wrapper.cache_clear = entries.clear
+        return wrapper
+    return decorator
@@ -0,0 +1,291 @@
+"""
+Benchmarks for the hot paths of the assignments and the Project dashboards.
+
+Every benchmark runs on synthetic inputs generated at the chosen size, so no
+dataset or display is needed. For each one the harness reports throughput,
+latency percentiles and peak Python memory, can save the results as a JSON
+baseline and flags regressions against a saved baseline.
+
+    python benchmarks/run_benchmarks.py --size medium --save baseline.json
+    python benchmarks/run_benchmarks.py --size medium --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import lru_cache
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("Assignment1", "Assignment3", "Project"):
+    sys.path.append(os.path.join(repo_dir, directory))
+
+# Input sizes: 2D grid points per side, 3D grid points per side, seeds,
+# integration steps, entities and years of the emission tables
+SIZES = {
+    'small': dict(grid=250, volume=48, seeds=64, steps=200, entities=50, years=100),
+    'medium': dict(grid=1000, volume=96, seeds=512, steps=500, entities=150, years=200),
+    'large': dict(grid=2500, volume=160, seeds=2048, steps=1000, entities=250, years=273),
+}
+
+
+def analytic_image(n):
+    # 2D scalar field with many closed contours and saddles
+    y, x = np.mgrid[0:n, 0:n] * (12 * np.pi / n)
+    values = np.sin(x) * np.cos(y) + 0.25 * np.sin(0.5 * x + 0.3 * y)
+    image = vtk.vtkImageData()
+    image.SetDimensions(n, n, 1)
+    image.GetPointData().SetScalars(numpy_support.numpy_to_vtk(values.ravel(), deep=True))
+    return image
+
+
+def analytic_vortex(n):
+    # Tornado-like vector field: swirl around the z axis with uplift, on [-5, 5]^3
+    from final import VectorField
+    spacing = 10 / (n - 1)
+    z, y, x = np.mgrid[0:n, 0:n, 0:n] * spacing - 5
+    r = np.sqrt(x * x + y * y) + 1e-6
+    swirl = np.exp(-r / 3)
+    vectors = np.stack([-y / r * swirl + 0.02 * x, x / r * swirl + 0.02 * y, 0.2 + 0 * r], axis=-1)
+    return VectorField(vectors.reshape(-1, 3), (0, n - 1, 0, n - 1, 0, n - 1), (-5, -5, -5), (spacing,) * 3)
+
+
+def analytic_volume(n):
+    # 3D scalar volume in the range of mixture.vti
+    z, y, x = np.mgrid[0:n, 0:n, 0:n] * (4 * np.pi / n)
+    volume = 0.7 * np.sin(x) * np.sin(y) * np.sin(z) - 0.25
+    return np.asfortranarray(volume.transpose(2, 1, 0)).astype(np.float32)
+
+
+def notebook_cells(namespace, markers):
+    # Execute the Assignment2 notebook cells starting with the given comments
+    with open(os.path.join(repo_dir, "Assignment2", "code.ipynb"), encoding="utf-8") as f:
+        cells = json.load(f)["cells"]
+    for marker in markers:
+        source = next("".join(c["source"]) for c in cells if "".join(c["source"]).startswith(marker))
+        exec(source, namespace)
+    return namespace
+
+
+def write_emission_tables(directory, entities, years):
+    # Synthetic per-capita and by-source tables with the same columns as the CSVs
+    import pandas as pd
+    rng = np.random.default_rng(0)
+    names = ["Entity %d" % i for i in range(entities)]
+    year_range = np.arange(2022 - years + 1, 2023)
+    entity_column = np.repeat(names, years)
+    year_column = np.tile(year_range, entities)
+    codes = np.repeat(["E%02d" % i for i in range(entities)], years)
+    sources = rng.gamma(0.5, 1.0, size=(len(year_column), 6)).astype(np.float64)
+
+    pd.DataFrame({
+        "Entity": entity_column, "Code": codes, "Year": year_column,
+        "Annual CO₂ emissions (per capita)": sources.sum(axis=1),
+    }).to_csv(os.path.join(directory, "co-emissions-per-capita.csv"), index=False)
+    by_source = pd.DataFrame({"Entity": entity_column, "Code": codes, "Year": year_column})
+    for i, source in enumerate(["coal", "oil", "gas", "flaring", "cement", "other industry"]):
+        by_source["Annual CO₂ emissions from %s (per capita)" % source] = sources[:, i]
+    by_source.to_csv(os.path.join(directory, "per-capita-co2-by-source.csv"), index=False)
+    return names, year_range
+
+
+def bench_isocontour(size):
+    from ques1 import generate_smooth_isocontour
+    n = size['grid']
+    image = analytic_image(n)
+    return dict(run=lambda: generate_smooth_isocontour(image, 0.1), items=(n - 1) ** 2, unit='cells')
+
+
+def bench_streamline_rk4(size):
+    from final import RK4_integration
+    field = analytic_vortex(size['volume'])
+    steps = size['steps']
+    return dict(run=lambda: RK4_integration([2.0, 0.0, -4.5], 0.01, steps, field), items=steps, unit='steps')
+
+
+def bench_streamline_batch(size):
+    from final import trace_streamlines, random_seeds
+    field = analytic_vortex(size['volume'])
+    seeds = random_seeds(field.bounds * 0.9, size['seeds'])
+    steps = size['steps']
+    return dict(run=lambda: trace_streamlines(seeds, 0.01, steps, field), items=2 * len(seeds) * steps, unit='steps')
+
+
+def bench_isosurface(size):
+    namespace = dict(np=np, vtk=vtk, numpy_support=numpy_support, lru_cache=lru_cache,
+                     dataset=analytic_volume(size['volume']))
+    notebook_cells(namespace, ["# Building a multi-resolution pyramid"])
+    extract = namespace['extract_isosurface_mesh'].__wrapped__  # Bypass the LRU cache
+    isovalues = iter(np.tile(np.linspace(-0.8, 0.3, 23), 1000))
+    return dict(run=lambda: extract(int(round(next(isovalues) / 1e-3)), 0), items=size['volume'] ** 3, unit='voxels')
+
+
+def bench_histogram(size):
+    namespace = dict(np=np, dataset=analytic_volume(size['volume']))
+    notebook_cells(namespace, ["# Sorting the values once"])
+    range_histogram = namespace['range_histogram']
+    centers = iter(np.tile(np.linspace(-0.8, 0.3, 23), 1000))
+
+    def run():
+        center = next(centers)
+        range_histogram((center - 0.25, center + 0.25), 100)
+
+    return dict(run=run, items=1, unit='queries', repeat=200)
+
+
+def load_dashboards(size):
+    # Point the shared loader at synthetic tables before the apps load their data
+    if 'CO2_emission_per_capita' not in sys.modules:
+        directory = tempfile.mkdtemp(prefix="emissions_")
+        write_emission_tables(directory, size['entities'], size['years'])
+        os.environ["EMISSIONS_DATA_DIR"] = directory
+    import CO2_emission_per_capita
+    import emission_by_source
+    return CO2_emission_per_capita, emission_by_source
+
+
+def bench_update_map(size):
+    per_capita_app, _ = load_dashboards(size)
+    names = iter(["Entity %d" % (i % size['entities']) for i in range(10 ** 6)])
+
+    def run():
+        per_capita_app.update_map({"points": [{"hovertext": next(names)}]})
+
+    # Clear the memoized trends so every call does the full work
+    return dict(run=run, setup=per_capita_app.trend_series.cache_clear, items=1, unit='callbacks', repeat=200)
+
+
+def bench_update_bar_chart(size):
+    _, by_source_app = load_dashboards(size)
+    rng = np.random.default_rng(1)
+    years = by_source_app.first_year + np.arange(by_source_app.year_count)
+    names = list(by_source_app.entities)
+    update = by_source_app.update_bar_chart.__wrapped__  # Bypass the memoization
+
+    def run():
+        selection = list(rng.choice(names, size=min(10, len(names)), replace=False))
+        update(selection, int(rng.choice(years)))
+
+    return dict(run=run, items=1, unit='callbacks', repeat=200)
+
+
+BENCHMARKS = {
+    'isocontour': bench_isocontour,
+    'streamline_rk4': bench_streamline_rk4,
+    'streamline_batch': bench_streamline_batch,
+    'isosurface': bench_isosurface,
+    'histogram': bench_histogram,
+    'update_map': bench_update_map,
+    'update_bar_chart': bench_update_bar_chart,
+}
+
+
+def measure(benchmark, repeat=None, warmup=1):
+    """
+    Time repeat runs of a benchmark (the benchmark's own count for the
+    sub-millisecond ones unless given), then do one more run under
+    tracemalloc for the peak Python memory (kept out of the timed runs).
+    """
+    repeat = repeat or benchmark.get('repeat', 10)
+    setup = benchmark.get('setup')
+    for _ in range(warmup):
+        if setup:
+            setup()
+        benchmark['run']()
+
+    latencies = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        benchmark['run']()
+        latencies.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    benchmark['run']()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        'repeat': repeat,
+        'unit': benchmark['unit'],
+        'throughput': benchmark['items'] / latencies.mean(),
+        'mean_ms': latencies.mean() * 1000,
+        'p50_ms': np.percentile(latencies, 50) * 1000,
+        'p90_ms': np.percentile(latencies, 90) * 1000,
+        'p99_ms': np.percentile(latencies, 99) * 1000,
+        'peak_memory_mb': peak / 2 ** 20,
+    }
+
+
+def compare(results, baseline, threshold):
+    # Regressions: median latency or peak memory more than threshold above the baseline
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'peak_memory_mb'):
+            if previous[metric] > 0 and result[metric] > previous[metric] * (1 + threshold):
+                regressions.append("%s: %s %.3f -> %.3f (+%.0f%%)" % (
+                    name, metric, previous[metric], result[metric], 100 * (result[metric] / previous[metric] - 1)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the contouring, streamline, notebook and dashboard hot paths.")
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--only', help="comma separated benchmark names (default: all)")
+    parser.add_argument('--repeat', type=int, help="timed runs per benchmark (default 10, 200 for callbacks)")
+    parser.add_argument('--save', help="write the results to this JSON file (e.g. a new baseline)")
+    parser.add_argument('--compare', help="baseline JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed relative slowdown (default 0.25)")
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    size = SIZES[args.size]
+
+    results = {}
+    print("%-18s %14s %-9s %10s %10s %10s %10s" % ('benchmark', 'throughput', 'unit/s', 'p50 ms', 'p90 ms', 'p99 ms', 'peak MB'))
+    for name in names:
+        result = measure(BENCHMARKS[name](size), args.repeat)
+        results[name] = result
+        print("%-18s %14.1f %-9s %10.3f %10.3f %10.3f %10.2f" % (
+            name, result['throughput'], result['unit'], result['p50_ms'], result['p90_ms'], result['p99_ms'],
+            result['peak_memory_mb']))
+
+    # tracemalloc only sees Python allocations; the process peak also covers VTK's
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("Process peak resident memory: %.1f MB" % max_rss_mb)
+    report = {'size': args.size, 'python': platform.python_version(), 'machine': platform.machine(),
+              'max_rss_mb': max_rss_mb, 'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('size') != args.size:
+            print("Warning: baseline was recorded with --size %s" % baseline.get('size'))
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against %s" % args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import atexit
+import cProfile
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Stage timing is off unless INSTRUMENT=1 (or enable() is called); when off a
+# stage costs one flag check
+enabled = os.environ.get("INSTRUMENT") == "1"
+# Also record the traced allocation delta of each stage (starts tracemalloc, slower)
+track_allocations = os.environ.get("INSTRUMENT_ALLOCATIONS") == "1"
+# JSON lines file the stage totals are appended to by export_jsonl()
+output_file = os.environ.get("INSTRUMENT_OUTPUT")
+# cProfile output of a whole run (profile_run) or directory for per-request profiles
+profile_file = os.environ.get("INSTRUMENT_PROFILE")
+profile_dir = os.environ.get("INSTRUMENT_PROFILE_DIR")
+
+stages = {}
+lock = threading.Lock()
+# Numbers the per-request profiles so that no two requests share a file
+profile_counter = itertools.count()
+
+
+def enable(allocations=False):
+    global enabled, track_allocations
+    enabled = True
+    track_allocations = allocations
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    with lock:
+        stages.clear()
+
+
+def record(name, seconds, allocated=0):
+    # Add one call of a stage to its running totals
+    with lock:
+        totals = stages.get(name)
+        if totals is None:
+            totals = stages[name] = {'count': 0, 'total_s': 0.0, 'min_s': float('inf'), 'max_s': 0.0,
+                                     'allocated_bytes': 0}
+        totals['count'] += 1
+        totals['total_s'] += seconds
+        totals['min_s'] = min(totals['min_s'], seconds)
+        totals['max_s'] = max(totals['max_s'], seconds)
+        totals['allocated_bytes'] += allocated
+
+
+class Stage:
+    """
+    Context manager timing one named stage; returned by stage() only while
+    instrumentation is enabled.
+    """
+
+    __slots__ = ('name', 'start', 'memory')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.memory = tracemalloc.get_traced_memory()[0] if track_allocations else 0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        allocated = tracemalloc.get_traced_memory()[0] - self.memory if track_allocations else 0
+        record(self.name, seconds, allocated)
+        return False
+
+
+class NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+null_stage = NullStage()
+
+
+def stage(name):
+    # with stage("contour.extract"): ...
+    return Stage(name) if enabled else null_stage
+
+
+def timed(name=None):
+    """
+    Decorator recording every call of a function as a stage
+    (named module.function unless given).
+    """
+    def decorator(func):
+        stage_name = name or "%s.%s" % (func.__module__, func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summary():
+    # Stage totals sorted by total time, with the mean per call
+    with lock:
+        rows = [dict(stage=name, mean_s=totals['total_s'] / totals['count'], **totals)
+                for name, totals in stages.items()]
+    return sorted(rows, key=lambda row: row['total_s'], reverse=True)
+
+
+def print_summary():
+    print("%-40s %8s %12s %12s %12s" % ('stage', 'calls', 'total ms', 'mean ms', 'alloc KB'))
+    for row in summary():
+        print("%-40s %8d %12.3f %12.3f %12.1f" % (row['stage'], row['count'], row['total_s'] * 1000,
+                                                  row['mean_s'] * 1000, row['allocated_bytes'] / 1024))
+
+
+def export_jsonl(filename=None, **labels):
+    """
+    Append one JSON object per stage to a JSON lines file (INSTRUMENT_OUTPUT
+    by default). labels (e.g. run="tornado") are added to every line.
+    """
+    filename = filename or output_file
+    if not filename:
+        return
+    timestamp = time.time()
+    with open(filename, "a") as f:
+        for row in summary():
+            f.write(json.dumps(dict(time=timestamp, pid=os.getpid(), **labels, **row)) + "\n")
+
+
+class profile_run:
+    """
+    Profile a block with cProfile when a file is given (INSTRUMENT_PROFILE
+    by default) and dump the stats there; otherwise do nothing.
+    The stats can be read with pstats or snakeviz.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename or profile_file
+        self.profiler = None
+
+    def __enter__(self):
+        if self.filename:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.filename)
+        return False
+
+
+def instrument_server(server):
+    """
+    Time every request of a Flask server (a Dash app.server) as a stage
+    "http <path>", which covers the callback and the JSON serialization of its
+    output. When INSTRUMENT_PROFILE_DIR is set every request is also profiled,
+    one .prof file per request in that directory; clients cannot turn
+    profiling on themselves.
+    """
+    from flask import g, request
+
+    @server.before_request
+    def start_request():
+        if not enabled:
+            return
+        g.instrument_stage = Stage("http " + request.path).__enter__()
+        if profile_dir:
+            g.instrument_profiler = cProfile.Profile()
+            g.instrument_profiler.enable()
+
+    @server.teardown_request
+    def finish_request(exception):
+        profiler = g.pop("instrument_profiler", None)
+        if profiler:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            name = "%s-%d-%06d-%s.prof" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid(), next(profile_counter),
+                                           request.path.strip("/").replace("/", "_") or "index")
+            profiler.dump_stats(os.path.join(profile_dir, name))
+        request_stage = g.pop("instrument_stage", None)
+        if request_stage:
+            request_stage.__exit__(None, None, None)
+
+    return server
+
+
+if enabled and track_allocations:
+    tracemalloc.start()
+if enabled and output_file:
+    # Per-run export of everything recorded by the process
+    atexit.register(export_jsonl)
@@ -0,0 +1,135 @@
+import glob
+import os
+import re
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from common.vti_io import load_vti_array, to_vtk_image
+
+
+def sequence_files(pattern):
+    # Files matching a glob in timestep order (numbers in the names compare as numbers)
+    def natural_key(path):
+        return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+    return sorted(glob.glob(pattern), key=natural_key)
+
+
+def wildcard_regex(pattern):
+    # Regex matching the same paths as a glob, with one group per wildcard
+    parts = []
+    for part in re.split(r'(\*+|\?|\[!?\]?[^]]*\])', pattern):
+        if part.startswith('*'):
+            parts.append('(.*)')
+        elif part == '?':
+            parts.append('(.)')
+        elif part.startswith('[') and len(part) > 2:
+            parts.append('([%s])' % re.sub(r'^!', '^', part[1:-1]).replace('\\', '\\\\'))
+        else:
+            parts.append(re.escape(part))
+    return re.compile(''.join(parts) + r'\Z', re.DOTALL)
+
+
+def timestep_values(pattern, paths):
+    """
+    Time of every step: the last number in the part of its name matched by the
+    wildcards of pattern (so digits such as the 2 of "Isabel_2D" are not
+    read as times). Falls back to the positions in the sequence unless the
+    times are found for every file and strictly increasing.
+    """
+    regex = wildcard_regex(pattern)
+    times = []
+    for path in paths:
+        match = regex.match(path)
+        if not match:
+            break
+        # Keep only the characters matched by wildcards (adjacent ones stay together)
+        wildcard_text = [' '] * len(path)
+        for group in range(1, len(match.groups()) + 1):
+            start, end = match.span(group)
+            wildcard_text[start:end] = path[start:end]
+        numbers = re.findall(r'\d+(?:\.\d+)?', ''.join(wildcard_text))
+        if not numbers:
+            break
+        times.append(float(numbers[-1]))
+    else:
+        if all(a < b for a, b in zip(times, times[1:])):
+            return times
+    return [float(index) for index in range(len(paths))]
+
+
+def read_vti_arrays(filename, array_name=None):
+    # Read a whole timestep into memory (on the prefetch thread rather than at first use)
+    array, extent, origin, spacing = load_vti_array(filename, array_name)
+    return np.array(array), extent, origin, spacing
+
+
+def read_vti_image(filename, array_name=None):
+    return to_vtk_image(*read_vti_arrays(filename, array_name), array_name or 'Scalars')
+
+
+def prefetch(paths, load, depth=2, workers=2):
+    """
+    Yield (path, load(path)) in order while the following files are loaded
+    on a background thread pool. At most depth steps are loaded ahead of the
+    one being processed, which bounds the memory held by the queue.
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for path in paths:
+                pending.append((path, pool.submit(load, path)))
+                if len(pending) > depth:
+                    path, future = pending.popleft()
+                    yield path, future.result()
+            while pending:
+                path, future = pending.popleft()
+                yield path, future.result()
+        finally:
+            # Stopped early: drop the steps that were not started yet
+            for _, future in pending:
+                future.cancel()
+
+
+def write_pvd(filename, steps):
+    # ParaView collection of (time, file) steps; file paths are stored relative to the .pvd
+    root = ET.Element('VTKFile', type='Collection', version='0.1', byte_order='LittleEndian')
+    collection = ET.SubElement(root, 'Collection')
+    directory = os.path.dirname(os.path.abspath(filename))
+    for time, path in steps:
+        ET.SubElement(collection, 'DataSet', timestep=repr(time), group='', part='0',
+                      file=os.path.relpath(os.path.abspath(path), directory).replace(os.sep, '/'))
+    ET.indent(root)
+    ET.ElementTree(root).write(filename, xml_declaration=True, encoding='utf-8')
+
+
+def run_sequence(pattern, load, process, output_dir, pvd_name=None, depth=2, workers=2):
+    """
+    Run one pipeline over every file matching pattern, in timestep order.
+    Steps are loaded by load(path) on background threads while the current
+    step is processed and written; process(data, output_stem) writes the
+    outputs of one step under output_dir and returns the file to list in the
+    .pvd collection (or None). Returns the [(time, file)] steps.
+    """
+    paths = sequence_files(pattern)
+    if not paths:
+        raise FileNotFoundError("No files match %r" % pattern)
+    os.makedirs(output_dir, exist_ok=True)
+
+    times = timestep_values(pattern, paths)
+    steps = []
+    for time, (path, data) in zip(times, prefetch(paths, load, depth, workers)):
+        output_stem = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0])
+        output = process(data, output_stem)
+        if output:
+            steps.append((time, output))
+
+    if pvd_name and steps:
+        write_pvd(os.path.join(output_dir, pvd_name), steps)
+    return steps
+
+
+def is_sequence(pattern):
+    return any(character in pattern for character in '*?[')
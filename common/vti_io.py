@@ -0,0 +1,140 @@
+import re
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from common.instrument import timed
+
+# VTK XML data array types and their NumPy equivalents
+VTK_TYPES = {
+    'Int8': 'i1', 'UInt8': 'u1', 'Int16': 'i2', 'UInt16': 'u2',
+    'Int32': 'i4', 'UInt32': 'u4', 'Int64': 'i8', 'UInt64': 'u8',
+    'Float32': 'f4', 'Float64': 'f8',
+}
+# Start tag of an array stored inside the XML rather than in the appended block
+inline_array = re.compile(rb'<DataArray\b[^>]*\bformat="(?:binary|ascii)"')
+# End of a file without an appended block
+image_end = re.compile(rb'</ImageData>\s*</VTKFile>')
+
+
+def read_vti_header(filename):
+    """
+    Parse the XML header of a .vti file (everything before the appended block).
+    Returns the root element and the byte offset of the first appended byte,
+    or None for the offset when the appended data is not raw. Files with
+    inline (base64 or ASCII) arrays return (None, None) as soon as the first
+    such array is found, without reading the rest of the file.
+    """
+    head = bytearray()
+    start = marker = -1
+    with open(filename, 'rb') as f:
+        while marker < 0:
+            # Rescan a little of the previous chunk for tags split between chunks
+            scan_from = max(0, len(head) - 4096)
+            chunk = f.read(65536)
+            if not chunk:
+                return None, None
+            head += chunk
+            if start < 0:
+                start = head.find(b'<AppendedData', scan_from)
+                if start < 0 and (inline_array.search(head, scan_from) or image_end.search(head, scan_from)):
+                    return None, None
+            if start >= 0:
+                marker = head.find(b'_', start)
+        head = bytes(head)
+
+    appended = re.search(rb'encoding="(\w+)"', head[start:marker])
+    header = head[:start] + b'</VTKFile>'
+    root = ET.fromstring(header[header.index(b'<VTKFile'):])
+    if appended is None or appended.group(1) != b'raw':
+        return root, None
+    return root, marker + 1
+
+
+def load_vti_with_vtk(filename, array_name=None):
+    # Fallback for compressed, base64 or ASCII files
+    reader = vtk.vtkXMLImageDataReader()
+    reader.SetFileName(filename)
+    reader.Update()
+    image_data = reader.GetOutput()
+    point_data = image_data.GetPointData()
+    if array_name is not None:
+        vtk_array = point_data.GetArray(array_name)
+    else:
+        vtk_array = point_data.GetScalars() or point_data.GetVectors() or point_data.GetArray(0)
+    array = numpy_support.vtk_to_numpy(vtk_array)
+    return array, image_data.GetExtent(), image_data.GetOrigin(), image_data.GetSpacing()
+
+
+@timed("vti.read")
+def load_vti_array(filename, array_name=None):
+    """
+    Load one point data array of a .vti file without copying it.
+    Raw appended arrays are memory-mapped straight from the file; anything
+    else goes through vtkXMLImageDataReader.
+    Returns (array, extent, origin, spacing); the array is in VTK point order
+    (x varies fastest) with shape (points,) or (points, components).
+    """
+    root, data_start = read_vti_header(filename)
+    if root is None:
+        return load_vti_with_vtk(filename, array_name)
+    image = root.find('ImageData')
+    point_data = image.find('Piece/PointData')
+
+    if array_name is None:
+        array_name = point_data.get('Scalars') or point_data.get('Vectors')
+    arrays = point_data.findall('DataArray')
+    element = next((a for a in arrays if a.get('Name') == array_name), arrays[0] if arrays else None)
+
+    if (data_start is None or root.get('compressor') or element is None
+            or element.get('format') != 'appended'):
+        return load_vti_with_vtk(filename, array_name)
+
+    extent = tuple(int(v) for v in image.get('WholeExtent').split())
+    origin = tuple(float(v) for v in image.get('Origin', '0 0 0').split())
+    spacing = tuple(float(v) for v in image.get('Spacing', '1 1 1').split())
+
+    byte_order = '<' if root.get('byte_order', 'LittleEndian') == 'LittleEndian' else '>'
+    header_type = np.dtype(byte_order + VTK_TYPES[root.get('header_type', 'UInt32')])
+    dtype = np.dtype(byte_order + VTK_TYPES[element.get('type')])
+    components = int(element.get('NumberOfComponents', 1))
+
+    # Each raw appended array starts with its size in bytes
+    offset = data_start + int(element.get('offset'))
+    nbytes = int(np.fromfile(filename, dtype=header_type, count=1, offset=offset)[0])
+    count = nbytes // dtype.itemsize
+    array = np.memmap(filename, dtype=dtype, mode='r', offset=offset + header_type.itemsize, shape=(count,))
+    if not dtype.isnative:
+        # VTK and the vectorized code expect native byte order, so swap into memory
+        array = array.astype(dtype.newbyteorder('='))
+    if components > 1:
+        array = array.reshape(-1, components)
+    return array, extent, origin, spacing
+
+
+@timed("vti.to_vtk")
+def to_vtk_image(array, extent, origin, spacing, name='Scalars'):
+    # Wrap a loaded array in vtkImageData without copying it
+    image_data = vtk.vtkImageData()
+    image_data.SetExtent(extent)
+    image_data.SetOrigin(origin)
+    image_data.SetSpacing(spacing)
+    array = np.asarray(array)
+    if not array.dtype.isnative:
+        # VTK reads the raw bytes as native
+        array = array.astype(array.dtype.newbyteorder('='))
+    vtk_array = numpy_support.numpy_to_vtk(array, deep=False)
+    vtk_array.SetName(name)
+    if vtk_array.GetNumberOfComponents() == 3:
+        image_data.GetPointData().SetVectors(vtk_array)
+    else:
+        image_data.GetPointData().SetScalars(vtk_array)
+    return image_data
+
+
+def load_vti(filename, array_name=None):
+    # Load a .vti file as vtkImageData backed by the memory-mapped array
+    array, extent, origin, spacing = load_vti_array(filename, array_name)
+    return to_vtk_image(array, extent, origin, spacing, array_name or 'Scalars')
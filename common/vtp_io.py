@@ -0,0 +1,72 @@
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from common.instrument import timed
+
+COMPRESSORS = ('none', 'zlib', 'lz4', 'lzma')
+
+
+@timed("vtp.build")
+def polydata_from_arrays(points, connectivity, offsets):
+    """
+    Build vtkPolyData line cells in bulk from NumPy arrays.
+    points is (N, 3) (or (N, 2), padded with z = 0), connectivity lists the
+    point ids of all cells and offsets (cells + 1) marks where each cell starts.
+    """
+    points = np.asarray(points, dtype=float)
+    if points.shape[1] == 2:
+        points = np.column_stack([points, np.zeros(len(points))])
+
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(points), deep=True))
+
+    lines = vtk.vtkCellArray()
+    lines.SetData(numpy_support.numpy_to_vtkIdTypeArray(np.asarray(offsets, dtype=np.int64), deep=True),
+                  numpy_support.numpy_to_vtkIdTypeArray(np.asarray(connectivity, dtype=np.int64), deep=True))
+
+    poly_data = vtk.vtkPolyData()
+    poly_data.SetPoints(vtk_points)
+    poly_data.SetLines(lines)
+    return poly_data
+
+
+def polyline_polydata(curves):
+    # One polyline cell per curve; curves with fewer than two points are dropped
+    curves = [curve for curve in curves if len(curve) > 1]
+    points = np.concatenate(curves) if curves else np.zeros((0, 3))
+    offsets = np.concatenate([[0], np.cumsum([len(curve) for curve in curves])])
+    return polydata_from_arrays(points, np.arange(len(points)), offsets)
+
+
+@timed("vtp.write")
+def write_vtp(filename, poly_data, compressor='zlib', compression_level=5, appended=True):
+    """
+    Write vtkPolyData to a .vtp file.
+    compressor is one of 'none', 'zlib', 'lz4' or 'lzma'; with appended=True
+    the arrays are stored as one raw (not base64) appended binary block.
+    """
+    if compressor not in COMPRESSORS:
+        raise ValueError("Unknown compressor %r, expected one of %s" % (compressor, ", ".join(COMPRESSORS)))
+
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(filename)
+    writer.SetInputData(poly_data)
+
+    if compressor == 'none':
+        writer.SetCompressorTypeToNone()
+    elif compressor == 'zlib':
+        writer.SetCompressorTypeToZLib()
+    elif compressor == 'lz4':
+        writer.SetCompressorTypeToLZ4()
+    else:
+        writer.SetCompressorTypeToLZMA()
+    if compressor != 'none':
+        writer.SetCompressionLevel(compression_level)
+
+    if appended:
+        writer.SetDataModeToAppended()
+        writer.EncodeAppendedDataOff()
+    else:
+        writer.SetDataModeToBinary()
+    writer.Write()